@@ -1,29 +1,39 @@
-import os, io, csv, zipfile, uuid, re
+import os, csv, codecs, zipfile, json, asyncio, gzip, hashlib
 from pathlib import Path
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from typing import Optional, List
 
-from fastapi import FastAPI, Depends, HTTPException, UploadFile, File, Form, Query
-from fastapi.responses import HTMLResponse, JSONResponse, FileResponse, Response
+from fastapi import FastAPI, Depends, HTTPException, UploadFile, File, Form, Query, Request
+from fastapi.responses import HTMLResponse, JSONResponse, FileResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
+from fastapi.encoders import jsonable_encoder
 from pydantic import BaseModel, EmailStr
 from dotenv import load_dotenv
-from sqlalchemy.orm import Session
+from sqlalchemy import insert, select, update, func, case, and_, or_
+from sqlalchemy.orm import Session, defer, selectinload
 
-from database import Base, engine, get_db
+# .env chargé AVANT les modules locaux : ils lisent leur configuration à l'import
+load_dotenv()
+
+from database import ensure_schema, get_db, IS_POSTGRES
 from models import User, Job
-from auth import get_password_hash, verify_password, create_access_token, get_current_user
-from worker import ensure_worker_running, poke_worker
-from schemas import JobOut
+from auth import (
+    get_password_hash, verify_password, create_access_token,
+    get_current_user, get_current_user_readonly, get_current_user_sse, create_sse_token, SSE_TOKEN_TTL,
+)
+from worker import ensure_worker_running, poke_worker, job_deadline, scheduler_stats, collect_metrics, resume_stage
+from schemas import JobOut, JobListOut
+from storage import store_thumbnail, save_stream, FileTooLarge, MAX_THUMBNAIL_BYTES, last_usage as storage_usage
+from youtube_uploader import invalidate_youtube_client
+import events
+import metrics
 
 # ---------------------------------------------------------------------
 # Boot & Dossiers (compat Render)
 # ---------------------------------------------------------------------
-load_dotenv()
-
-# Base de données
-Base.metadata.create_all(bind=engine)
+# Base de données (tables + index ajoutés depuis)
+ensure_schema()
 
 # Répertoire de données (persistant sur Render si APP_DATA_DIR=/data)
 DATA_DIR = Path(os.getenv("APP_DATA_DIR", ".")).resolve()
@@ -66,10 +76,79 @@ app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"], allow_credentials=True,
     allow_methods=["*"], allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Server-Time", "ETag"],
 )
 
-# Lancer le worker (thread)
-ensure_worker_running()
+# Envois de fichiers : refus immédiat (413) si Content-Length dépasse la limite,
+# avant que le corps ne soit lu ; sinon (corps chunked) dès que les octets reçus
+# la dépassent. Marge pour les autres champs du formulaire.
+MAX_CLIENT_SECRET_BYTES = 64 * 1024
+FORM_OVERHEAD_BYTES = 256 * 1024
+UPLOAD_LIMITS = {
+    "/jobs": MAX_THUMBNAIL_BYTES + FORM_OVERHEAD_BYTES,
+    "/me/youtube/credentials": MAX_CLIENT_SECRET_BYTES + FORM_OVERHEAD_BYTES,
+}
+
+class _BodyTooLarge(Exception):
+    pass
+
+class LimitUploadSize:
+    """
+    Middleware ASGI pur : aucun surcoût pour les autres requêtes (SSE compris),
+    et compte les octets réellement reçus plutôt que de croire Content-Length.
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        limit = UPLOAD_LIMITS.get(scope["path"]) if scope["type"] == "http" and scope["method"] == "POST" else None
+        if limit is None:
+            return await self.app(scope, receive, send)
+        try:
+            length = int(dict(scope["headers"]).get(b"content-length") or 0)
+        except ValueError:
+            length = 0
+        if length > limit:
+            return await self._reject(scope, receive, send)
+
+        received = 0
+        exceeded = False
+
+        async def limited_receive():
+            nonlocal received, exceeded
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    exceeded = True
+                    raise _BodyTooLarge()
+            return message
+
+        async def guarded_send(message):
+            # limite dépassée : la réponse d'erreur de l'app (400 de parsing) est remplacée
+            if not exceeded:
+                await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except _BodyTooLarge:
+            pass
+        if exceeded:
+            await self._reject(scope, receive, send)
+
+    @staticmethod
+    async def _reject(scope, receive, send):
+        await JSONResponse({"detail": "Fichier trop volumineux"}, status_code=413)(scope, receive, send)
+
+app.add_middleware(LimitUploadSize)
+
+# Lancer le worker (threads) dans le process de l'API, sauf si les workers
+# tournent à part (python worker.py, éventuellement sur plusieurs machines)
+RUN_WORKER_IN_API = os.getenv("RUN_WORKER_IN_API", "1") == "1"
+if RUN_WORKER_IN_API:
+    ensure_worker_running()
+# Relais des événements de jobs venant d'autres process (Postgres)
+events.ensure_listener()
 
 # ---------------------------------------------------------------------
 # Schemas Auth
@@ -100,26 +179,37 @@ def pick_voice(category: str, explicit: Optional[str] = None) -> str:
     }
     return mapping.get((category or "").strip().lower(), "fr-FR-DeniseNeural")
 
-def safe_filename(name: str) -> str:
-    base = re.sub(r"[^A-Za-z0-9._-]", "_", (name or "").strip())
-    return base or f"file_{uuid.uuid4().hex[:8]}"
+# Réponses JSON conditionnelles (ETag / 304) et compressées au-delà de 1 Ko
+GZIP_MIN_SIZE = 1024
+
+def json_etag_response(request: Request, content, headers: Optional[dict] = None) -> Response:
+    body = json.dumps(jsonable_encoder(content), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    etag = f'"{hashlib.sha1(body).hexdigest()}"'
+    out_headers = {"ETag": etag, "Cache-Control": "private, no-cache", **(headers or {})}
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=out_headers)
+    if len(body) >= GZIP_MIN_SIZE and "gzip" in request.headers.get("accept-encoding", ""):
+        body = gzip.compress(body, compresslevel=6)
+        out_headers["Content-Encoding"] = "gzip"
+        out_headers["Vary"] = "Accept-Encoding"
+    return Response(body, media_type="application/json", headers=out_headers)
 
 # ---------------------------------------------------------------------
 # Profil / YouTube creds (par utilisateur)
 # ---------------------------------------------------------------------
 @app.get("/me")
-def me(user: User = Depends(get_current_user)):
+def me(user: User = Depends(get_current_user_readonly)):
     return {"id": user.id, "email": user.email}
 
 @app.get("/me/youtube/credentials")
-def youtube_credentials_status(user: User = Depends(get_current_user)):
+def youtube_credentials_status(user: User = Depends(get_current_user_readonly)):
     user_dir = TOKENS_DIR / str(user.id)
     client_secret = (user_dir / "client_secret.json").exists()
     token_file   = (user_dir / "youtube_token.json").exists()
     return {"client_secret": client_secret, "token_present": token_file}
 
 @app.post("/me/youtube/credentials")
-async def upload_youtube_client_secret(
+def upload_youtube_client_secret(
     file: UploadFile = File(...),
     user: User = Depends(get_current_user),
 ):
@@ -127,13 +217,16 @@ async def upload_youtube_client_secret(
         raise HTTPException(status_code=400, detail="Fichier attendu: .json")
     user_dir = TOKENS_DIR / str(user.id)
     user_dir.mkdir(parents=True, exist_ok=True)
-    dest = user_dir / "client_secret.json"
-    with open(dest, "wb") as f:
-        f.write(await file.read())
+    # endpoint synchrone : écriture par blocs dans le threadpool, hors boucle
+    try:
+        save_stream(file.file, user_dir / "client_secret.json", MAX_CLIENT_SECRET_BYTES)
+    except FileTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
     # on supprime l'ancien token pour forcer un nouveau consentement propre
     old_token = user_dir / "youtube_token.json"
     if old_token.exists():
         old_token.unlink()
+    invalidate_youtube_client(user.id)
     return {"ok": True}
 
 # ---------------------------------------------------------------------
@@ -141,6 +234,8 @@ async def upload_youtube_client_secret(
 # Colonnes: title,description,tags,script_text,voice_category,speed,publish_iso,thumbnail
 # ---------------------------------------------------------------------
 STORAGE_THUMBS = str(STORAGE_DIR / "thumbs")
+# Lignes insérées par lot (executemany) pendant l'import
+BULK_BATCH_SIZE = max(1, int(os.getenv("BULK_BATCH_SIZE", "500")))
 
 @app.post("/bulk")
 def bulk_create_jobs(
@@ -150,18 +245,36 @@ def bulk_create_jobs(
     db: Session = Depends(get_db),
     user: User = Depends(get_current_user),
 ):
-    thumb_dir = STORAGE_THUMBS
-    if thumbs_zip:
-        tmp_sub = f"bulk_{uuid.uuid4().hex[:8]}"
-        thumb_dir = os.path.join(STORAGE_THUMBS, tmp_sub)
-        os.makedirs(thumb_dir, exist_ok=True)
-        data = thumbs_zip.file.read()
-        with zipfile.ZipFile(io.BytesIO(data)) as z:
-            z.extractall(thumb_dir)
-
-    raw = csv_file.file.read()
-    text = raw.decode("utf-8-sig")
-    reader = csv.DictReader(io.StringIO(text))
+    # Import en flux : le CSV est lu ligne à ligne et le ZIP n'est jamais
+    # chargé ni décompressé en entier (seul son répertoire central est lu).
+    archive = zipfile.ZipFile(thumbs_zip.file) if thumbs_zip else None
+    stored: dict[str, str] = {}
+
+    def resolve_thumb(thumb_name: str) -> str:
+        if thumb_name in stored:
+            return stored[thumb_name]
+        thumb_path = ""
+        if archive is not None:
+            try:
+                info = archive.getinfo(thumb_name)
+            except KeyError:
+                info = None
+            if info is not None and not info.is_dir():
+                # stockage par hash : une image partagée par N lignes = 1 fichier
+                with archive.open(info) as fi:
+                    try:
+                        thumb_path = store_thumbnail(fi, thumb_name, MAX_THUMBNAIL_BYTES)
+                    except FileTooLarge:
+                        thumb_path = ""  # image ignorée, comme une miniature absente
+        else:
+            src = os.path.realpath(os.path.join(STORAGE_THUMBS, thumb_name))
+            if src.startswith(STORAGE_THUMBS + os.sep) and os.path.isfile(src):
+                with open(src, "rb") as fi:
+                    thumb_path = store_thumbnail(fi, thumb_name)
+        stored[thumb_name] = thumb_path
+        return thumb_path
+
+    reader = csv.DictReader(codecs.iterdecode(csv_file.file, "utf-8-sig"))
     required = {"title","description","tags","script_text","voice_category","speed","publish_iso","thumbnail"}
     if set(map(str.strip, reader.fieldnames or [])) != required:
         return JSONResponse(
@@ -169,51 +282,55 @@ def bulk_create_jobs(
             content={"detail": f"En-têtes CSV invalides. Attendu: {','.join(sorted(required))}"}
         )
 
-    created = []
-    for row in reader:
-        title = (row["title"] or "").strip()
-        if not title:
-            continue
-        description = (row["description"] or "").strip()
-        tags = (row["tags"] or "").strip()
-        script_text = (row["script_text"] or "").strip()
-        voice_category = (row["voice_category"] or "femme").strip()
-        try:
-            speed = float(row["speed"] or default_speed)
-        except:
-            speed = default_speed
-        publish_iso = (row["publish_iso"] or "").strip()
-        thumb_name = (row["thumbnail"] or "").strip()
+    created_count = 0
+    created_titles = []
+    batch = []
+    try:
+        for row in reader:
+            title = (row["title"] or "").strip()
+            if not title:
+                continue
+            description = (row["description"] or "").strip()
+            tags = (row["tags"] or "").strip()
+            script_text = (row["script_text"] or "").strip()
+            voice_category = (row["voice_category"] or "femme").strip()
+            try:
+                speed = float(row["speed"] or default_speed)
+            except:
+                speed = default_speed
+            publish_iso = (row["publish_iso"] or "").strip()
+            thumb_name = (row["thumbnail"] or "").strip()
+
+            batch.append(dict(
+                user_id=user.id,
+                title=title,
+                description=description,
+                tags=tags,
+                script_text=script_text,
+                voice=pick_voice(voice_category, None),
+                speed=speed,
+                publish_iso=publish_iso,
+                deadline_at=job_deadline(publish_iso),
+                thumbnail_path=resolve_thumb(thumb_name) if thumb_name else "",
+                status="READY",
+                progress_msg="",
+            ))
+            created_count += 1
+            if len(created_titles) < 10:
+                created_titles.append(title)
+            if len(batch) >= BULK_BATCH_SIZE:
+                db.execute(insert(Job), batch)
+                batch.clear()
+
+        if batch:
+            db.execute(insert(Job), batch)
+        db.commit()
+    finally:
+        if archive is not None:
+            archive.close()
 
-        thumb_path = ""
-        if thumb_name:
-            src = os.path.join(thumb_dir, thumb_name)
-            if os.path.exists(src):
-                base, ext = os.path.splitext(safe_filename(thumb_name))
-                unique = f"{uuid.uuid4().hex[:8]}_{base}{ext}"
-                dst = os.path.join(STORAGE_THUMBS, unique)
-                with open(src, "rb") as fi, open(dst, "wb") as fo:
-                    fo.write(fi.read())
-                thumb_path = str(Path(dst)).replace("\\", "/")
-
-        job = Job(
-            user_id=user.id,
-            title=title,
-            description=description,
-            tags=tags,
-            script_text=script_text,
-            voice=pick_voice(voice_category, None),
-            speed=speed,
-            publish_iso=publish_iso,
-            thumbnail_path=thumb_path,
-            status="READY",
-            progress_msg="",
-        )
-        db.add(job)
-        created.append(title)
-
-    db.commit()
-    return {"created_count": len(created), "created_titles": created[:10]}
+    poke_worker()
+    return {"created_count": created_count, "created_titles": created_titles}
 
 # ---------------------------------------------------------------------
 # Auth
@@ -226,7 +343,7 @@ def register(payload: RegisterIn, db: Session = Depends(get_db)):
         raise HTTPException(status_code=400, detail="Email deja utilise")
     user = User(email=payload.email, password_hash=get_password_hash(payload.password))
     db.add(user); db.commit(); db.refresh(user)
-    token = create_access_token({"sub": str(user.id)})
+    token = create_access_token({"sub": str(user.id), "email": user.email})
     return _TokenOutModel(access_token=token, token_type="bearer")
 
 @app.post("/auth/login", response_model=_TokenOutModel)
@@ -234,14 +351,14 @@ def login(payload: LoginIn, db: Session = Depends(get_db)):
     user = db.query(User).filter(User.email == payload.email).first()
     if not user or not verify_password(payload.password, user.password_hash):
         raise HTTPException(status_code=401, detail="Identifiants invalides")
-    token = create_access_token({"sub": str(user.id)})
+    token = create_access_token({"sub": str(user.id), "email": user.email})
     return _TokenOutModel(access_token=token, token_type="bearer")
 
 # ---------------------------------------------------------------------
 # Jobs
 # ---------------------------------------------------------------------
 @app.post("/jobs", response_model=JobOut)
-async def create_job(
+def create_job(
     title: str = Form(...),
     description: str = Form(""),
     tags: str = Form(""),
@@ -250,6 +367,7 @@ async def create_job(
     voice: str = Form(""),
     speed: float = Form(1.1),
     publish_iso: Optional[str] = Form(None),
+    profile: bool = Form(False),
     thumbnail: UploadFile = File(...),
     db: Session = Depends(get_db),
     user: User = Depends(get_current_user),
@@ -259,88 +377,212 @@ async def create_job(
 
     chosen_voice = voice.strip() or pick_voice(voice_category, None)
 
-    # nom sûr + unique
-    original = thumbnail.filename or "thumb.jpg"
-    base, ext = os.path.splitext(safe_filename(original))
-    unique = f"{uuid.uuid4().hex[:8]}_{base}{ext}"
-    thumb_path = STORAGE_DIR / "thumbs" / unique
-    with open(thumb_path, "wb") as f:
-        f.write(await thumbnail.read())
-    thumb_path_str = str(thumb_path).replace("\\", "/")
+    # stockage par hash du contenu (dédoublonnage des envois identiques) ;
+    # endpoint synchrone => copie par blocs dans le threadpool, hors boucle
+    try:
+        thumb_path_str = store_thumbnail(thumbnail.file, thumbnail.filename or "thumb.jpg", MAX_THUMBNAIL_BYTES)
+    except FileTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
 
     job = Job(
         user_id=user.id,
         title=title, description=description, tags=tags,
         script_text=script_text, voice=chosen_voice, speed=speed,
         publish_iso=(publish_iso or "").strip() or "",  # "" = publication immédiate
+        deadline_at=job_deadline(publish_iso),
         thumbnail_path=thumb_path_str,
+        profile=profile,  # cProfile de chaque étage (storage/profiles)
         status="READY",
         progress_msg="",
     )
     db.add(job); db.commit(); db.refresh(job)
     poke_worker()
+    events.publish(events.job_event(job))
     return job
 
-@app.get("/jobs", response_model=List[JobOut])
+@app.get("/jobs", response_model=List[JobListOut])
 def list_jobs(
+    request: Request,
     limit: int = Query(50, ge=1, le=200),
     offset: int = Query(0, ge=0),
+    cursor: Optional[int] = Query(None, description="En-tête X-Next-Cursor de la page précédente"),
     status: Optional[str] = Query(None),
+    updated_since: Optional[datetime] = Query(None, description="En-tête X-Server-Time d'un appel précédent"),
     db: Session = Depends(get_db),
-    user: User = Depends(get_current_user),
+    user: User = Depends(get_current_user_readonly),
 ):
-    q = db.query(Job).filter(Job.user_id == user.id)
+    server_time = datetime.now(timezone.utc)
+    q = (
+        db.query(Job)
+          .options(defer(Job.script_text), defer(Job.description))
+          .filter(Job.user_id == user.id)
+    )
     if status:
         q = q.filter(Job.status == status)
-    jobs = q.order_by(Job.created_at.desc()).offset(offset).limit(limit).all()
-    return jobs
+    if updated_since is not None:
+        # delta : seuls les jobs modifiés depuis (1 s de recouvrement, les doublons sont sans effet)
+        since = updated_since.astimezone(timezone.utc) if updated_since.tzinfo else updated_since.replace(tzinfo=timezone.utc)
+        since -= timedelta(seconds=1)
+        if not IS_POSTGRES:
+            since = since.replace(tzinfo=None)  # SQLite : horodatages UTC naïfs
+        q = q.filter(func.coalesce(Job.updated_at, Job.created_at) >= since)
+    if cursor is not None:
+        # pagination par curseur sur (created_at, id) : coût constant quelle que soit la page.
+        # created_at est relu en base pour comparer des valeurs stockées à l'identique.
+        cursor_created = select(Job.created_at).where(Job.id == cursor, Job.user_id == user.id).scalar_subquery()
+        q = q.filter(or_(
+            Job.created_at < cursor_created,
+            and_(Job.created_at == cursor_created, Job.id < cursor),
+        ))
+    elif offset:
+        q = q.offset(offset)
+    jobs = q.order_by(Job.created_at.desc(), Job.id.desc()).limit(limit).all()
+
+    headers = {"X-Server-Time": server_time.isoformat().replace("+00:00", "Z")}
+    if len(jobs) == limit:
+        headers["X-Next-Cursor"] = str(jobs[-1].id)
+    items = [JobListOut.model_validate(j, from_attributes=True) for j in jobs]
+    return json_etag_response(request, items, headers)
+
+# Flux SSE : transitions de statut et progress_msg, poussés par le worker
+SSE_KEEPALIVE = 15.0
+
+@app.post("/jobs/events/token")
+def job_events_token(user: User = Depends(get_current_user_readonly)):
+    # jeton de courte durée du flux SSE : à redemander à chaque (re)connexion
+    return {"token": create_sse_token(user), "expires_in": SSE_TOKEN_TTL}
+
+@app.get("/jobs/events")
+async def job_events(request: Request, user: User = Depends(get_current_user_sse)):
+    user_id = user.id
+    q = events.subscribe(user_id)
+
+    async def stream():
+        try:
+            yield "retry: 5000\n\n"
+            while not await request.is_disconnected():
+                try:
+                    event = await asyncio.wait_for(q.get(), timeout=SSE_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+                yield f"event: job\ndata: {json.dumps(event)}\n\n"
+        finally:
+            events.unsubscribe(user_id, q)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 @app.get("/jobs/{job_id}", response_model=JobOut)
-def job_detail(job_id: int, db: Session = Depends(get_db), user: User = Depends(get_current_user)):
+def job_detail(job_id: int, db: Session = Depends(get_db), user: User = Depends(get_current_user_readonly)):
+    # timeline : chronologie des étapes (job_events), chargée avec le job
+    job = (
+        db.query(Job)
+          .options(selectinload(Job.timeline))
+          .filter(Job.id == job_id, Job.user_id == user.id)
+          .first()
+    )
+    if not job:
+        raise HTTPException(status_code=404, detail="Job introuvable")
+    return job
+
+_RESUME_LABELS = {"tts": "synthèse audio", "render": "rendu vidéo", "upload": "upload YouTube"}
+
+@app.post("/jobs/{job_id}/retry", response_model=JobOut)
+def retry_job(job_id: int, db: Session = Depends(get_db), user: User = Depends(get_current_user)):
+    """
+    Relance un job en échec. Les étages dont l'artefact est encore valide
+    (audio, vidéo) sont sautés ; la session d'upload résumable est conservée.
+    """
     job = db.query(Job).filter(Job.id == job_id, Job.user_id == user.id).first()
     if not job:
         raise HTTPException(status_code=404, detail="Job introuvable")
+    if job.status != "FAILED":
+        raise HTTPException(status_code=409, detail="Seuls les jobs en échec peuvent être relancés")
+
+    label = _RESUME_LABELS[resume_stage(job)]
+    # UPDATE conditionnel : deux relances simultanées ne remettent le job en file qu'une fois
+    res = db.execute(
+        update(Job)
+        .where(Job.id == job_id, Job.status == "FAILED")
+        .values(status="READY", retry_at=None, lease_owner=None, lease_expires_at=None,
+                progress_msg=f"Nouvel essai : reprise à l’étape {label}…")
+    )
+    db.commit()
+    if res.rowcount != 1:
+        raise HTTPException(status_code=409, detail="Seuls les jobs en échec peuvent être relancés")
+    db.refresh(job)
+    poke_worker()
+    events.publish(events.job_event(job))
     return job
 
 # ---------------------------------------------------------------------
 # Stats
 # ---------------------------------------------------------------------
 @app.get("/stats")
-def stats(db: Session = Depends(get_db), user: User = Depends(get_current_user)):
+def stats(request: Request, db: Session = Depends(get_db), user: User = Depends(get_current_user_readonly)):
     now = datetime.utcnow()
     today_start = datetime(now.year, now.month, now.day)
     week_start = today_start - timedelta(days=today_start.weekday())
     month_start = datetime(now.year, now.month, 1)
 
-    base = db.query(Job).filter(Job.user_id == user.id)
-
-    def count_since(start_dt): return base.filter(Job.created_at >= start_dt).count()
-    def count_status(start_dt, st): return base.filter(Job.created_at >= start_dt, Job.status == st).count()
-
-    return {
-        "created_today": count_since(today_start),
-        "created_week": count_since(week_start),
-        "created_month": count_since(month_start),
-        "published_today": count_status(today_start, "PUBLISHED"),
-        "scheduled_today": count_status(today_start, "SCHEDULED"),
-        "failed_today": count_status(today_start, "FAILED"),
-        "totals": {
-            "ready": base.filter(Job.status=="READY").count(),
-            "rendering": base.filter(Job.status=="RENDERING").count(),
-            "done": base.filter(Job.status=="DONE").count(),
-            "uploading": base.filter(Job.status=="UPLOADING").count(),
-            "scheduled": base.filter(Job.status=="SCHEDULED").count(),
-            "published": base.filter(Job.status=="PUBLISHED").count(),
-            "failed": base.filter(Job.status=="FAILED").count(),
-        }
-    }
+    # Une seule requête : comptages conditionnels sur l'index (user_id, status, created_at)
+    def count_if(*conds): return func.count(case((and_(*conds), 1)))
+
+    statuses = ["READY", "RENDERING", "DONE", "UPLOADING", "DEFERRED", "SCHEDULED", "PUBLISHED", "FAILED"]
+    row = (
+        db.query(
+            count_if(Job.created_at >= today_start),
+            count_if(Job.created_at >= week_start),
+            count_if(Job.created_at >= month_start),
+            count_if(Job.created_at >= today_start, Job.status == "PUBLISHED"),
+            count_if(Job.created_at >= today_start, Job.status == "SCHEDULED"),
+            count_if(Job.created_at >= today_start, Job.status == "FAILED"),
+            *[count_if(Job.status == st) for st in statuses],
+        )
+        .filter(Job.user_id == user.id)
+        .one()
+    )
+
+    return json_etag_response(request, {
+        "created_today": row[0],
+        "created_week": row[1],
+        "created_month": row[2],
+        "published_today": row[3],
+        "scheduled_today": row[4],
+        "failed_today": row[5],
+        "totals": {st.lower(): n for st, n in zip(statuses, row[6:])},
+    })
 
 # ---------------------------------------------------------------------
 # Health
 # ---------------------------------------------------------------------
 @app.get("/health")
 def health():
-    return {"ok": True}
+    # attente en file par politique d'ordonnancement (worker de ce process)
+    # et occupation de storage/ par catégorie (octets) au dernier balayage du
+    # worker : aucun parcours du disque ici (vide si le worker tourne à part)
+    return {"ok": True, "scheduler": scheduler_stats(), "storage": storage_usage()}
+
+# ---------------------------------------------------------------------
+# Metrics (format texte Prometheus)
+# ---------------------------------------------------------------------
+# Si défini, /metrics exige "Authorization: Bearer <METRICS_TOKEN>"
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+JOBS_BY_STATUS = metrics.Gauge("autopub_jobs", "Jobs en base, par statut (tous utilisateurs)", ("status",))
+
+@app.get("/metrics")
+def metrics_endpoint(request: Request, db: Session = Depends(get_db)):
+    if METRICS_TOKEN and request.headers.get("authorization") != f"Bearer {METRICS_TOKEN}":
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    # seule requête du scrape : un comptage groupé ; le reste est en mémoire
+    rows = db.query(Job.status, func.count(Job.id)).group_by(Job.status).all()
+    JOBS_BY_STATUS.replace({(status,): n for status, n in rows})
+    collect_metrics()
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
 
 # ---------------------------------------------------------------------
 # Main (local)
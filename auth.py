@@ -1,15 +1,39 @@
 # auth.py
-import os, time, jwt
-from fastapi import Depends, HTTPException
+import os, time, threading, jwt
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional, Union
+from fastapi import Depends, HTTPException, Query
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from sqlalchemy.orm import Session
-from database import get_db
+from database import SessionLocal
 from models import User
 from passlib.hash import pbkdf2_sha256
 
 security = HTTPBearer()
 SECRET_KEY = os.getenv("JWT_SECRET", "local-secret-key-change-me")
 
+# Cache LRU des utilisateurs authentifiés (évite un SELECT par requête). Aucun
+# endpoint ne modifie un compte : une modification faite ailleurs (ou une
+# suppression) est prise en compte au plus tard après AUTH_CACHE_TTL secondes.
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", "30"))
+AUTH_CACHE_SIZE = max(1, int(os.getenv("AUTH_CACHE_SIZE", "1024")))
+# Endpoints en lecture seule : se fier aux claims signés du JWT, sans base
+AUTH_TRUST_CLAIMS = os.getenv("AUTH_TRUST_CLAIMS", "0") == "1"
+# Jeton du flux SSE (passé dans l'URL, donc visible dans les logs) : courte durée,
+# valable uniquement sur /jobs/events
+SSE_TOKEN_TTL = 60
+
+_user_cache: "OrderedDict[int, tuple[float, User]]" = OrderedDict()
+_user_cache_lock = threading.Lock()
+
+@dataclass(frozen=True)
+class ClaimsUser:
+    """
+    Utilisateur reconstruit depuis le token signé (AUTH_TRUST_CLAIMS=1).
+    """
+    id: int
+    email: str
+
 def get_password_hash(password: str) -> str:
     return pbkdf2_sha256.hash(password)
 
@@ -21,17 +45,61 @@ def create_access_token(data: dict, expires_in: int = 60*60*8) -> str:
     to_encode.update({"exp": int(time.time()) + expires_in})
     return jwt.encode(to_encode, SECRET_KEY, algorithm="HS256")
 
-def get_current_user(
-    credentials: HTTPAuthorizationCredentials = Depends(security),
-    db: Session = Depends(get_db)
-) -> User:
-    token = credentials.credentials
+def create_sse_token(user: Union[User, ClaimsUser]) -> str:
+    return create_access_token({"sub": str(user.id), "email": user.email, "scope": "sse"}, expires_in=SSE_TOKEN_TTL)
+
+def _load_user(user_id: int) -> Optional[User]:
+    now = time.monotonic()
+    with _user_cache_lock:
+        hit = _user_cache.get(user_id)
+        if hit and now - hit[0] < AUTH_CACHE_TTL:
+            _user_cache.move_to_end(user_id)
+            return hit[1]
+    with SessionLocal() as db:
+        user = db.get(User, user_id)
+        if user is None:
+            return None
+        db.expunge(user)  # instance détachée, attributs déjà chargés
+    with _user_cache_lock:
+        _user_cache[user_id] = (now, user)
+        _user_cache.move_to_end(user_id)
+        while len(_user_cache) > AUTH_CACHE_SIZE:
+            _user_cache.popitem(last=False)
+    return user
+
+def _decode_token(token: str) -> dict:
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
+        return jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
     except Exception:
         raise HTTPException(status_code=401, detail="Token invalide")
+
+def _user_from_token(token: str, trust_claims: bool = False, scope: Optional[str] = None) -> Union[User, ClaimsUser]:
+    payload = _decode_token(token)
+    # un jeton SSE n'ouvre pas l'API, et le JWT principal n'est pas accepté dans l'URL
+    if payload.get("scope") != scope:
+        raise HTTPException(status_code=401, detail="Token invalide")
     user_id = int(payload.get("sub", "0"))
-    user = db.query(User).get(user_id)
+    if trust_claims and user_id:
+        return ClaimsUser(id=user_id, email=payload.get("email", ""))
+    user = _load_user(user_id)
     if not user:
         raise HTTPException(status_code=401, detail="Utilisateur introuvable")
     return user
+
+def get_current_user(
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+) -> User:
+    return _user_from_token(credentials.credentials)
+
+def get_current_user_readonly(
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+) -> Union[User, ClaimsUser]:
+    # Lecture seule : peut se contenter des claims signés si AUTH_TRUST_CLAIMS=1
+    return _user_from_token(credentials.credentials, trust_claims=AUTH_TRUST_CLAIMS)
+
+def get_current_user_sse(token: Optional[str] = Query(None)) -> Union[User, ClaimsUser]:
+    # EventSource ne peut pas envoyer d'en-tête Authorization : ?token= avec un
+    # jeton SSE de courte durée (POST /jobs/events/token), jamais le JWT principal
+    if not token:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    return _user_from_token(token, trust_claims=AUTH_TRUST_CLAIMS, scope="sse")
@@ -0,0 +1,118 @@
+# bench_api.py — charge sur l'API en process (client ASGI, SQLite temporaire, worker arrêté)
+# Usage : python bench_api.py [--requests 500] [--concurrency 16] [--bulk-rows 1000]
+# Dépendance de dev : pip install httpx
+import os, sys, io, csv, time, argparse, asyncio, shutil, tempfile
+
+# Environnement isolé AVANT d'importer l'app (base et storage dans un dossier temporaire)
+WORKDIR = tempfile.mkdtemp(prefix="autopub-bench-api-")
+os.environ["APP_DATA_DIR"] = WORKDIR
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, APP_DIR)
+os.chdir(WORKDIR)
+
+import httpx
+from PIL import Image
+
+import worker
+# on mesure l'API seule : pas de threads worker (les jobs restent READY)
+worker.ensure_worker_running = lambda: None
+import app as app_module
+
+def _thumbnail_bytes() -> bytes:
+    buf = io.BytesIO()
+    Image.new("RGB", (1280, 720), (255, 106, 162)).save(buf, "JPEG")
+    return buf.getvalue()
+
+def _bulk_csv(rows: int) -> bytes:
+    buf = io.StringIO()
+    w = csv.writer(buf)
+    w.writerow(["title", "description", "tags", "script_text", "voice_category", "speed", "publish_iso", "thumbnail"])
+    for i in range(rows):
+        w.writerow([f"bulk {i}", "desc", "a,b", "Texte du script " * 20, "femme", "1.2", "", ""])
+    return buf.getvalue().encode()
+
+def _percentile(values: list[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))] if values else 0.0
+
+async def _load(name: str, make_request, total: int, concurrency: int) -> dict:
+    latencies: list[float] = []
+    errors = 0
+    counter = iter(range(total))
+
+    async def runner():
+        nonlocal errors
+        for i in counter:
+            t0 = time.perf_counter()
+            r = await make_request(i)
+            latencies.append(time.perf_counter() - t0)
+            if r.status_code >= 400:
+                errors += 1
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(runner() for _ in range(concurrency)))
+    wall = time.perf_counter() - t0
+    return {
+        "name": name, "n": len(latencies), "errors": errors, "rps": len(latencies) / wall,
+        "p50": _percentile(latencies, 50) * 1000, "p99": _percentile(latencies, 99) * 1000,
+    }
+
+async def main_async(args):
+    transport = httpx.ASGITransport(app=app_module.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        r = await client.post("/auth/register", json={"email": "bench@example.com", "password": "bench"})
+        headers = {"Authorization": f"Bearer {r.json()['access_token']}"}
+        thumb = _thumbnail_bytes()
+        bulk = _bulk_csv(args.bulk_rows)
+        job_ids: list[int] = []
+
+        async def create_job(i):
+            r = await client.post(
+                "/jobs", headers=headers,
+                data={"title": f"job {i}", "script_text": "Texte du script " * 50, "voice_category": "femme"},
+                files={"thumbnail": (f"t{i % 10}.jpg", thumb, "image/jpeg")},
+            )
+            if r.status_code == 200:
+                job_ids.append(r.json()["id"])
+            return r
+
+        async def job_detail(i):
+            return await client.get(f"/jobs/{job_ids[i % len(job_ids)]}", headers=headers)
+
+        async def list_jobs(i):
+            return await client.get("/jobs", headers=headers, params={"limit": 50})
+
+        async def stats(i):
+            return await client.get("/stats", headers=headers)
+
+        async def bulk_import(i):
+            return await client.post("/bulk", headers=headers, files={"csv_file": ("jobs.csv", bulk, "text/csv")})
+
+        scenarios = [
+            ("POST /jobs", create_job, args.requests),
+            ("GET /jobs/{id}", job_detail, args.requests),
+            ("GET /jobs", list_jobs, args.requests),
+            ("GET /stats", stats, args.requests),
+            (f"POST /bulk ({args.bulk_rows} l.)", bulk_import, args.bulk_requests),
+        ]
+        print(f"{'endpoint':<24} {'req':>6} {'err':>5} {'req/s':>9} {'p50 ms':>9} {'p99 ms':>9}")
+        for name, fn, total in scenarios:
+            # bulk : requêtes lourdes, concurrence limitée
+            concurrency = min(args.concurrency, 2) if fn is bulk_import else args.concurrency
+            res = await _load(name, fn, total, concurrency)
+            print(f"{res['name']:<24} {res['n']:>6} {res['errors']:>5} {res['rps']:>9.1f} {res['p50']:>9.1f} {res['p99']:>9.1f}")
+
+def main():
+    ap = argparse.ArgumentParser(description="Charge sur l'API en process (SQLite)")
+    ap.add_argument("--requests", type=int, default=500, help="requêtes par endpoint")
+    ap.add_argument("--concurrency", type=int, default=16)
+    ap.add_argument("--bulk-rows", type=int, default=1000)
+    ap.add_argument("--bulk-requests", type=int, default=5)
+    args = ap.parse_args()
+    try:
+        asyncio.run(main_async(args))
+    finally:
+        shutil.rmtree(WORKDIR, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
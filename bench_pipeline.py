@@ -0,0 +1,183 @@
+# bench_pipeline.py — débit du pipeline worker hors ligne (TTS et YouTube simulés)
+# Usage : python bench_pipeline.py [--jobs 8] [--chars 500,3000] [--workers 1,2,4] [--tts-latency 0.2]
+# Tout se passe dans un dossier temporaire : base SQLite, storage/, faux serveur d'upload.
+import os, sys, time, argparse, asyncio, shutil, tempfile, threading
+
+# Environnement isolé AVANT d'importer les modules de l'app (ils lisent l'env à l'import)
+WORKDIR = tempfile.mkdtemp(prefix="autopub-bench-")
+os.environ["APP_DATA_DIR"] = WORKDIR
+os.environ.setdefault("YOUTUBE_DAILY_QUOTA", str(10 ** 9))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.chdir(WORKDIR)  # autopub_local.db créé ici
+
+try:
+    import resource  # Unix seulement : pic de RSS indisponible sous Windows
+except ImportError:
+    resource = None
+
+from PIL import Image
+from google.oauth2.credentials import Credentials
+
+import tts, worker, youtube_uploader
+from database import SessionLocal, ensure_schema
+from models import Job, JobEvent, User
+from storage import THUMBS_DIR
+from fake_youtube import run_fake_server
+
+# -----------------------
+# MP3 silencieux (MPEG-1 Layer III, 32 kHz mono, 32 kb/s)
+# -----------------------
+# En-tête FF FB 18 C0 + side info et données nulles : trame de 144 octets,
+# 1152 échantillons (36 ms) que tout décodeur lit comme du silence.
+_SILENT_FRAME = bytes([0xFF, 0xFB, 0x18, 0xC0]) + bytes(140)
+_FRAME_SECONDS = 1152 / 32000
+CHARS_PER_SECOND = 15  # débit de parole approximatif d'edge-tts
+
+def silent_mp3(seconds: float) -> bytes:
+    return _SILENT_FRAME * max(1, int(seconds / _FRAME_SECONDS))
+
+def _install_stand_ins(tts_latency: float, upload_url: str):
+    async def fake_edge(text: str, voice: str, rate: str) -> bytes:
+        await asyncio.sleep(tts_latency)  # aller-retour réseau simulé
+        return silent_mp3(len(text) / CHARS_PER_SECOND)
+
+    tts._edge_tts_bytes = fake_edge
+    tts._gtts_bytes = lambda text, voice: silent_mp3(len(text) / CHARS_PER_SECOND)
+
+    creds = Credentials(token="bench")
+    youtube_uploader.YOUTUBE_UPLOAD_URL = upload_url
+    youtube_uploader._client_for_user = lambda user_id: (None, creds)
+    youtube_uploader.set_thumbnail = lambda *a, **k: None
+
+# -----------------------
+# Mesures
+# -----------------------
+def _proc_write_bytes() -> int | None:
+    try:
+        with open("/proc/self/io") as f:
+            for line in f:
+                if line.startswith("write_bytes:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+def _dir_bytes(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+def _peak_rss_mb() -> tuple[float, float] | None:
+    # ru_maxrss : Ko sous Linux, octets sous macOS ; enfants = ffmpeg
+    if resource is None:
+        return None
+    scale = 1 if sys.platform == "darwin" else 1024
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale
+    return own / 1e6, children / 1e6
+
+def _percentile(values: list[float], p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+# -----------------------
+# Scénario
+# -----------------------
+_round = 0
+
+def _create_jobs(n: int, chars: int, thumb: str) -> list[int]:
+    global _round
+    _round += 1
+    words = "Lorem ipsum dolor sit amet, consectetur adipiscing elit. "
+    with SessionLocal() as db:
+        jobs = []
+        for i in range(n):
+            # texte unique par job : le cache audio ne doit pas fausser la mesure
+            script = f"Run {_round} job {i}. " + (words * (chars // len(words) + 1))[:chars]
+            jobs.append(Job(user_id=1, title=f"bench {_round}-{i}", script_text=script,
+                            voice=tts.DEFAULT_VOICE, speed=1.0, publish_iso="",
+                            thumbnail_path=thumb, status="READY", progress_msg=""))
+        db.add_all(jobs)
+        db.commit()
+        return [j.id for j in jobs]
+
+def _worker_thread():
+    while True:
+        with SessionLocal() as db:
+            job = worker._claim_next_job(db)
+            if job is None:
+                return
+            worker._process_job(db, job)
+
+def run_round(n: int, chars: int, workers: int, thumb: str) -> dict:
+    ids = _create_jobs(n, chars, thumb)
+    io0, disk0 = _proc_write_bytes(), _dir_bytes(WORKDIR)
+    t0 = time.perf_counter()
+    threads = [threading.Thread(target=_worker_thread) for _ in range(workers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - t0
+    io1, disk1 = _proc_write_bytes(), _dir_bytes(WORKDIR)
+
+    with SessionLocal() as db:
+        statuses = [s for (s,) in db.query(Job.status).filter(Job.id.in_(ids))]
+        events = db.query(JobEvent.stage, JobEvent.duration_ms).filter(JobEvent.job_id.in_(ids)).all()
+    stages: dict[str, list[float]] = {}
+    for stage, ms in events:
+        stages.setdefault(stage, []).append(ms / 1000)
+    return {
+        "ok": sum(s in ("PUBLISHED", "SCHEDULED") for s in statuses),
+        "wall": wall,
+        "jobs_per_hour": n / wall * 3600,
+        "stages": stages,
+        "disk_mb": (disk1 - disk0) / 1e6,
+        "io_mb": (io1 - io0) / 1e6 if io0 is not None and io1 is not None else None,
+    }
+
+def main():
+    ap = argparse.ArgumentParser(description="Débit du pipeline worker hors ligne")
+    ap.add_argument("--jobs", type=int, default=8)
+    ap.add_argument("--chars", default="500,3000", help="longueurs de script (caractères)")
+    ap.add_argument("--workers", default="1,2,4", help="nombre de workers parallèles")
+    ap.add_argument("--tts-latency", type=float, default=0.2, help="latence simulée par morceau edge-tts (s)")
+    ap.add_argument("--keep", action="store_true", help="conserver le dossier de travail")
+    args = ap.parse_args()
+
+    ensure_schema()
+    with SessionLocal() as db:
+        db.add(User(id=1, email="bench@example.com", password_hash="x"))
+        db.commit()
+    thumb = str(THUMBS_DIR / "bench.png")
+    Image.new("RGB", (1280, 720), (255, 106, 162)).save(thumb)
+
+    server, url = run_fake_server()
+    _install_stand_ins(args.tts_latency, url)
+    print(f"dossier de travail : {WORKDIR}")
+    print(f"{'car.':>6} {'workers':>7} {'ok':>5} {'jobs/h':>8} {'tts p50/p99':>13} {'encode p50/p99':>15} "
+          f"{'upload p50/p99':>15} {'disque Mo':>10} {'écrit Mo':>9}")
+    for chars in [int(c) for c in args.chars.split(",")]:
+        for workers in [int(w) for w in args.workers.split(",")]:
+            r = run_round(args.jobs, chars, workers, thumb)
+            pct = lambda st: f"{_percentile(r['stages'].get(st, []), 50):.2f}/{_percentile(r['stages'].get(st, []), 99):.2f}"
+            io = f"{r['io_mb']:.1f}" if r["io_mb"] is not None else "n/a"
+            print(f"{chars:>6} {workers:>7} {r['ok']:>2}/{args.jobs:<2} {r['jobs_per_hour']:>8.0f} {pct('tts'):>13} "
+                  f"{pct('encode'):>15} {pct('upload'):>15} {r['disk_mb']:>10.1f} {io:>9}")
+    rss = _peak_rss_mb()
+    if rss is not None:
+        print(f"RSS max : {rss[0]:.0f} Mo (process) / {rss[1]:.0f} Mo (ffmpeg)")
+    print(f"octets reçus par le faux YouTube : {server.state.bytes_received / 1e6:.1f} Mo")
+    server.shutdown()
+    if not args.keep:
+        shutil.rmtree(WORKDIR, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+# bench_render.py — compare les moteurs de rendu (ffmpeg direct vs MoviePy)
+# Usage : python bench_render.py [minutes ...]   (ex: python bench_render.py 1 5)
+import os, sys, time, tempfile, subprocess
+
+from PIL import Image
+
+from video import render_video, _ffmpeg_exe
+
+def _make_inputs(workdir: str, minutes: float):
+    thumb = os.path.join(workdir, "thumb.png")
+    Image.new("RGB", (1280, 720), (255, 106, 162)).save(thumb)
+    # MP3 mono 24 kHz / 48 kb/s, comme la sortie d'edge-tts
+    audio = os.path.join(workdir, f"voice_{minutes}.mp3")
+    subprocess.run(
+        [_ffmpeg_exe(), "-hide_banner", "-loglevel", "error", "-y",
+         "-f", "lavfi", "-i", f"sine=frequency=220:sample_rate=24000:duration={minutes * 60}",
+         "-ac", "1", "-c:a", "libmp3lame", "-b:a", "48k", audio],
+        check=True,
+    )
+    return thumb, audio
+
+def main():
+    durations = [float(a) for a in sys.argv[1:]] or [1.0, 5.0]
+    threads = int(os.getenv("RENDER_THREADS", "2"))
+    print(f"{'moteur':<8} {'audio (min)':>11} {'rendu (s)':>10} {'s / min audio':>14} {'taille (Mo)':>12}")
+    with tempfile.TemporaryDirectory() as workdir:
+        for minutes in durations:
+            thumb, audio = _make_inputs(workdir, minutes)
+            for engine in ("ffmpeg", "moviepy"):
+                out = os.path.join(workdir, f"{engine}_{minutes}.mp4")
+                t0 = time.perf_counter()
+                render_video(thumb, audio, out, threads=threads, engine=engine)
+                dt = time.perf_counter() - t0
+                size = os.path.getsize(out) / 1e6
+                print(f"{engine:<8} {minutes:>11.1f} {dt:>10.2f} {dt / minutes:>14.2f} {size:>12.2f}")
+
+if __name__ == "__main__":
+    main()
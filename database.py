@@ -1,6 +1,6 @@
 # database.py
-import os
-from sqlalchemy import create_engine
+import os, select, time
+from sqlalchemy import create_engine, inspect, text
 from sqlalchemy.orm import sessionmaker, declarative_base
 
 DATABASE_URL = os.getenv("DATABASE_URL", "").strip()
@@ -11,6 +11,8 @@ if DATABASE_URL:
 else:
     engine = create_engine("sqlite:///./autopub_local.db", connect_args={"check_same_thread": False})
 
+IS_POSTGRES = engine.dialect.name == "postgresql"
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
@@ -20,3 +22,71 @@ def get_db():
         yield db
     finally:
         db.close()
+
+def ensure_schema():
+    """
+    create_all ne modifie pas les tables déjà créées : on ajoute ici les
+    colonnes (nullable) et index apparus depuis, pour les bases existantes
+    (SQLite ou Render).
+    """
+    Base.metadata.create_all(bind=engine)
+    insp = inspect(engine)
+    for table in Base.metadata.sorted_tables:
+        columns = {c["name"] for c in insp.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in columns:
+                ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(dialect=engine.dialect)}"
+                try:
+                    with engine.begin() as conn:
+                        conn.execute(text(ddl))
+                except Exception:
+                    pass  # ajoutée en parallèle par un autre process
+        indexes = {i["name"] for i in insp.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in indexes:
+                try:
+                    index.create(bind=engine, checkfirst=True)
+                except Exception:
+                    pass  # créé en parallèle par un autre process
+
+# -----------------------
+# LISTEN / NOTIFY (Postgres uniquement)
+# -----------------------
+def pg_notify(channel: str, payload: str = ""):
+    try:
+        with engine.begin() as conn:
+            conn.execute(text("SELECT pg_notify(:channel, :payload)"), {"channel": channel, "payload": payload})
+    except Exception:
+        pass
+
+def pg_listen_forever(channel: str, on_notify, timeout: float = 60.0):
+    """
+    Écoute un canal NOTIFY sur une connexion dédiée (à lancer dans un thread).
+    on_notify(payload) est appelé pour chaque notification reçue.
+    """
+    while True:
+        raw = None
+        try:
+            raw = engine.raw_connection()
+            conn = raw.driver_connection
+            conn.autocommit = True
+            conn.cursor().execute(f"LISTEN {channel}")
+            if hasattr(conn, "poll"):
+                # psycopg2
+                while True:
+                    if select.select([conn], [], [], timeout)[0]:
+                        conn.poll()
+                        while conn.notifies:
+                            on_notify(conn.notifies.pop(0).payload)
+            else:
+                # psycopg 3
+                for notify in conn.notifies():
+                    on_notify(notify.payload)
+        except Exception:
+            time.sleep(5.0)
+        finally:
+            if raw is not None:
+                try:
+                    raw.invalidate()
+                except Exception:
+                    pass
@@ -0,0 +1,81 @@
+# events.py — diffusion temps réel des changements de jobs (SSE)
+import asyncio, json, threading, uuid
+
+from database import IS_POSTGRES, pg_notify, pg_listen_forever
+
+# Entre process (worker séparé, plusieurs instances de l'API) : NOTIFY Postgres
+EVENTS_CHANNEL = "autopub_job_events"
+_ORIGIN = uuid.uuid4().hex
+
+_subscribers: dict[int, set] = {}
+_lock = threading.Lock()
+_listener_started = False
+
+def job_event(job) -> dict:
+    """
+    Instantané sérialisable d'un job (à prendre AVANT db.commit(),
+    pour ne pas recharger la ligne expirée).
+    """
+    return {
+        "id": job.id,
+        "user_id": job.user_id,
+        "status": job.status,
+        "progress_msg": (job.progress_msg or "")[:1000],
+        "audio_path": job.audio_path,
+        "video_path": job.video_path,
+        "youtube_video_id": job.youtube_video_id,
+    }
+
+def _put(q: asyncio.Queue, event: dict):
+    if q.full():
+        # client trop lent : on sacrifie l'événement le plus ancien
+        q.get_nowait()
+    q.put_nowait(event)
+
+def _dispatch(event: dict):
+    with _lock:
+        subs = list(_subscribers.get(event["user_id"], ()))
+    for loop, q in subs:
+        try:
+            loop.call_soon_threadsafe(_put, q, event)
+        except RuntimeError:
+            pass  # boucle fermée
+
+def publish(event: dict):
+    """
+    Appelable depuis n'importe quel thread (worker, endpoints).
+    """
+    _dispatch(event)
+    if IS_POSTGRES:
+        pg_notify(EVENTS_CHANNEL, json.dumps({**event, "origin": _ORIGIN}))
+
+def _on_notify(payload: str):
+    try:
+        event = json.loads(payload)
+    except ValueError:
+        return
+    if event.pop("origin", None) != _ORIGIN:
+        _dispatch(event)
+
+def ensure_listener():
+    global _listener_started
+    if _listener_started or not IS_POSTGRES:
+        return
+    t = threading.Thread(target=pg_listen_forever, args=(EVENTS_CHANNEL, _on_notify), name="autopub-events-listen", daemon=True)
+    t.start()
+    _listener_started = True
+
+def subscribe(user_id: int) -> asyncio.Queue:
+    # à appeler depuis la boucle asyncio qui consommera la file
+    q: asyncio.Queue = asyncio.Queue(maxsize=256)
+    with _lock:
+        _subscribers.setdefault(user_id, set()).add((asyncio.get_running_loop(), q))
+    return q
+
+def unsubscribe(user_id: int, q: asyncio.Queue):
+    with _lock:
+        subs = _subscribers.get(user_id)
+        if subs:
+            subs.difference_update({s for s in subs if s[1] is q})
+            if not subs:
+                _subscribers.pop(user_id, None)
@@ -0,0 +1,107 @@
+# fake_youtube.py — faux serveur d'upload YouTube (protocole résumable), pour tests locaux
+# Usage : python fake_youtube.py [port]
+#   puis YOUTUBE_UPLOAD_URL=http://127.0.0.1:<port>/upload/youtube/v3/videos
+import json, sys, threading, uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+class FakeYouTube:
+    """
+    État partagé du faux serveur : sessions d'upload en cours et vidéos reçues.
+    fail_at : si défini, la première requête qui ferait dépasser ce nombre
+    d'octets reçus échoue (503), pour simuler une coupure en plein upload.
+    quota_exceeded : si vrai, toute création de session est refusée (403 quotaExceeded).
+    """
+    def __init__(self, fail_at: int | None = None, quota_exceeded: bool = False):
+        self.fail_at = fail_at
+        self.quota_exceeded = quota_exceeded
+        self.sessions: dict[str, dict] = {}
+        self.videos: dict[str, dict] = {}
+        self.thumbnails: dict[str, int] = {}
+        self.bytes_received = 0
+        self.lock = threading.Lock()
+
+class _Handler(BaseHTTPRequestHandler):
+    server_version = "FakeYouTube/1.0"
+
+    def log_message(self, *args):
+        pass
+
+    @property
+    def state(self) -> FakeYouTube:
+        return self.server.state
+
+    def _send(self, code: int, payload: dict | None = None, headers: dict | None = None):
+        body = json.dumps(payload).encode() if payload is not None else b""
+        self.send_response(code)
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        if payload is not None:
+            self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        qs = parse_qs(url.query)
+        data = self._body()
+        if url.path.endswith("/thumbnails/set"):
+            with self.state.lock:
+                self.state.thumbnails[qs.get("videoId", [""])[0]] = len(data)
+            return self._send(200, {"items": []})
+        if not url.path.endswith("/videos") or qs.get("uploadType") != ["resumable"]:
+            return self._send(400, {"error": {"message": "unsupported"}})
+        if self.state.quota_exceeded:
+            return self._send(403, {"error": {"code": 403, "message": "quota", "errors": [{"reason": "quotaExceeded"}]}})
+        upload_id = uuid.uuid4().hex
+        with self.state.lock:
+            self.state.sessions[upload_id] = {
+                "size": int(self.headers.get("X-Upload-Content-Length") or 0),
+                "received": 0,
+                "metadata": json.loads(data or b"{}"),
+            }
+        host = self.headers.get("Host")
+        self._send(200, headers={"Location": f"http://{host}{url.path}?uploadType=resumable&upload_id={upload_id}"})
+
+    def do_PUT(self):
+        qs = parse_qs(urlparse(self.path).query)
+        upload_id = qs.get("upload_id", [""])[0]
+        data = self._body()
+        st = self.state
+        with st.lock:
+            session = st.sessions.get(upload_id)
+            if session is None:
+                return self._send(404, {"error": {"message": "session inconnue"}})
+            crange = self.headers.get("Content-Range", "")
+            if not crange.startswith("bytes */"):
+                start = int(crange.split(" ", 1)[1].split("-", 1)[0])
+                if st.fail_at is not None and session["received"] + len(data) > st.fail_at:
+                    st.fail_at = None
+                    return self._send(503, {"error": {"message": "coupure simulée"}})
+                if start == session["received"]:
+                    session["received"] += len(data)
+                    st.bytes_received += len(data)
+            if session["received"] >= session["size"]:
+                video_id = session.setdefault("video_id", f"fake{upload_id[:8]}")
+                st.videos[video_id] = {"size": session["size"], "metadata": session["metadata"]}
+                return self._send(201, {"id": video_id, **session["metadata"]})
+            headers = {"Range": f"bytes=0-{session['received'] - 1}"} if session["received"] else {}
+            self._send(308, headers=headers)
+
+def run_fake_server(port: int = 0, state: FakeYouTube | None = None):
+    """
+    Démarre le serveur dans un thread. Renvoie (server, url d'upload des vidéos).
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", port), _Handler)
+    server.state = state or FakeYouTube()
+    threading.Thread(target=server.serve_forever, name="fake-youtube", daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}/upload/youtube/v3/videos"
+
+if __name__ == "__main__":
+    srv, url = run_fake_server(int(sys.argv[1]) if len(sys.argv) > 1 else 8765)
+    print(f"YOUTUBE_UPLOAD_URL={url}")
+    threading.Event().wait()
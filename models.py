@@ -1,5 +1,7 @@
+from datetime import datetime, timezone
 
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Float
+from sqlalchemy import Column, Integer, BigInteger, String, Text, DateTime, ForeignKey, Float, Index, Boolean
+from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from database import Base
 
@@ -25,7 +27,54 @@ class Job(Base):
     audio_path = Column(String(512), nullable=True)
     video_path = Column(String(512), nullable=True)
     youtube_video_id = Column(String(64), nullable=True)
+    # Points de reprise : empreinte des entrées ayant produit audio_path / video_path
+    audio_key = Column(String(64), nullable=True)
+    video_key = Column(String(64), nullable=True)
+    # Upload résumable : session YouTube en cours et octets déjà acquittés
+    upload_session_uri = Column(Text, nullable=True)
+    upload_offset = Column(BigInteger, default=0)
+    # Échéance pour l'ordonnanceur EDF (publication programmée, sinon création + marge)
+    deadline_at = Column(DateTime(timezone=True), nullable=True)
+    # DEFERRED (quota YouTube épuisé) : date de nouvelle tentative d'upload
+    retry_at = Column(DateTime(timezone=True), nullable=True)
+    # Profilage cProfile de chaque étage (opt-in, voir storage/profiles)
+    profile = Column(Boolean, default=False)
+    # Bail du worker qui traite le job (renouvelé par heartbeat, repris à expiration)
+    lease_owner = Column(String(128), nullable=True)
+    lease_expires_at = Column(DateTime(timezone=True), nullable=True)
     status = Column(String(32), default="READY")
     progress_msg = Column(Text, default="")
     created_at = Column(DateTime(timezone=True), server_default=func.now())
-    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+    # horloge Python (UTC) et non now() : sur Postgres, now() vaut le début de la
+    # transaction, qui peut précéder de plusieurs minutes l'écriture (delta /jobs)
+    updated_at = Column(DateTime(timezone=True), onupdate=lambda: datetime.now(timezone.utc))
+
+    timeline = relationship("JobEvent", order_by="JobEvent.id", lazy="select", viewonly=True)
+
+    __table_args__ = (
+        # /stats : comptages par utilisateur, statut et date de création
+        Index("ix_jobs_user_status_created", "user_id", "status", "created_at"),
+        # /jobs : pagination par curseur (created_at, id) par utilisateur
+        Index("ix_jobs_user_created", "user_id", "created_at"),
+        # worker : prochain job READY (FIFO ou échéance la plus proche)
+        Index("ix_jobs_status_created", "status", "created_at"),
+        Index("ix_jobs_status_deadline", "status", "deadline_at"),
+        Index("ix_jobs_status_retry", "status", "retry_at"),
+        Index("ix_jobs_status_lease", "status", "lease_expires_at"),
+    )
+
+class JobEvent(Base):
+    """
+    Étape d'un job (tts, ensure_1080p, encode, upload, email) : début, fin,
+    durée et octets produits/envoyés. Une ligne par étape terminée.
+    """
+    __tablename__ = "job_events"
+    id = Column(Integer, primary_key=True)
+    job_id = Column(Integer, ForeignKey("jobs.id"), nullable=False, index=True)
+    stage = Column(String(32), nullable=False)
+    outcome = Column(String(16), nullable=False)  # ok | error | deferred | skipped
+    started_at = Column(DateTime(timezone=True), nullable=False)
+    ended_at = Column(DateTime(timezone=True), nullable=False)
+    duration_ms = Column(Integer, nullable=False)
+    bytes = Column(BigInteger, nullable=True)
+    detail = Column(Text, nullable=True)
@@ -1,13 +1,13 @@
 
+from datetime import datetime
 from pydantic import BaseModel
-from typing import Optional
+from typing import List, Optional
 
-class JobOut(BaseModel):
+class JobListOut(BaseModel):
+    # Vue liste : sans les gros champs texte (voir /jobs/{job_id})
     id: int
     title: str
-    description: str
     tags: str
-    script_text: str
     voice: str
     speed: float
     publish_iso: Optional[str]
@@ -20,3 +20,21 @@ class JobOut(BaseModel):
 
     class Config:
         orm_mode = True
+
+class JobEventOut(BaseModel):
+    stage: str
+    outcome: str
+    started_at: datetime
+    ended_at: datetime
+    duration_ms: int
+    bytes: Optional[int]
+    detail: Optional[str]
+
+    class Config:
+        orm_mode = True
+
+class JobOut(JobListOut):
+    description: str
+    script_text: str
+    # Étapes terminées, dans l'ordre (durées, octets)
+    timeline: List[JobEventOut] = []
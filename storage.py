@@ -0,0 +1,284 @@
+# storage.py — fichiers stockés (miniatures adressées par contenu) et cycle de vie du disque
+import os, re, time, shutil, hashlib, threading, uuid
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import BinaryIO, Optional
+
+# Dossiers (persistants si APP_DATA_DIR défini)
+DATA_DIR = Path(os.getenv("APP_DATA_DIR", ".")).resolve()
+STORAGE_DIR = (DATA_DIR / "storage").resolve()
+THUMBS_DIR = STORAGE_DIR / "thumbs"
+THUMBS_DIR.mkdir(parents=True, exist_ok=True)
+AUDIO_DIR = STORAGE_DIR / "audio"
+AUDIO_CACHE_DIR = AUDIO_DIR / "cache"
+VIDEO_DIR = STORAGE_DIR / "video"
+PROFILES_DIR = STORAGE_DIR / "profiles"
+for _d in (AUDIO_CACHE_DIR, VIDEO_DIR, PROFILES_DIR):
+    _d.mkdir(parents=True, exist_ok=True)
+
+CHUNK_SIZE = 1024 * 1024
+# Taille max d'une miniature envoyée (Mo)
+MAX_THUMBNAIL_BYTES = int(float(os.getenv("MAX_THUMBNAIL_MB", "10")) * 1024 * 1024)
+_IMAGE_EXTS = {".jpg", ".png", ".webp", ".gif", ".bmp"}
+
+# Noms écrits par store_thumbnail : <sha256><ext>
+_STORED_THUMB = re.compile(r"[0-9a-f]{64}\.[a-z]+")
+
+def _thumb_ext(filename: str) -> str:
+    ext = os.path.splitext(filename or "")[1].lower()
+    if ext == ".jpeg":
+        ext = ".jpg"
+    return ext if ext in _IMAGE_EXTS else ".jpg"
+
+class FileTooLarge(ValueError):
+    def __init__(self, max_bytes: int):
+        super().__init__(f"Fichier trop volumineux (max {max_bytes // (1024 * 1024) or 1} Mo)")
+        self.max_bytes = max_bytes
+
+def copy_stream(src: BinaryIO, dst: BinaryIO, max_bytes: Optional[int] = None, h=None) -> int:
+    """
+    Copie par blocs de CHUNK_SIZE (mémoire constante), en alimentant le hash h
+    au passage. Lève FileTooLarge dès que max_bytes est dépassé.
+    """
+    total = 0
+    while True:
+        chunk = src.read(CHUNK_SIZE)
+        if not chunk:
+            return total
+        total += len(chunk)
+        if max_bytes is not None and total > max_bytes:
+            raise FileTooLarge(max_bytes)
+        if h is not None:
+            h.update(chunk)
+        dst.write(chunk)
+
+def save_stream(src: BinaryIO, dest: Path, max_bytes: Optional[int] = None) -> int:
+    """
+    Écrit src dans dest de façon atomique (rien n'est remplacé si l'envoi échoue).
+    """
+    tmp = dest.with_name(f".{dest.name}.{uuid.uuid4().hex}.part")
+    try:
+        with open(tmp, "wb") as f:
+            n = copy_stream(src, f, max_bytes)
+        os.replace(tmp, dest)
+        return n
+    finally:
+        if tmp.exists():
+            tmp.unlink()
+
+def store_thumbnail(src: BinaryIO, filename: str, max_bytes: Optional[int] = None) -> str:
+    """
+    Copie une miniature dans thumbs/<sha256><ext>.
+    Deux envois identiques partagent le même fichier (et donc le même 1080p).
+    """
+    h = hashlib.sha256()
+    tmp = THUMBS_DIR / f".{uuid.uuid4().hex}.part"
+    try:
+        with open(tmp, "wb") as f:
+            copy_stream(src, f, max_bytes, h)
+        dst = THUMBS_DIR / f"{h.hexdigest()}{_thumb_ext(filename)}"
+        if not dst.exists():
+            os.replace(tmp, dst)
+    finally:
+        if tmp.exists():
+            tmp.unlink()
+    return str(dst).replace("\\", "/")
+
+# ---------------------------------------------------------------------
+# Cycle de vie : occupation par catégorie, rétention, budget disque
+# ---------------------------------------------------------------------
+# Budget total de storage/ (0 = illimité) et réserve à laisser libre sur le disque
+STORAGE_BUDGET_BYTES = int(float(os.getenv("STORAGE_BUDGET_MB", "0")) * 1024 * 1024)
+STORAGE_MIN_FREE_BYTES = int(float(os.getenv("STORAGE_MIN_FREE_MB", "512")) * 1024 * 1024)
+# Rétention : vidéo + audio supprimés après upload confirmé (PUBLISHED/SCHEDULED),
+# et après ce délai pour les jobs FAILED
+RETAIN_AFTER_UPLOAD_HOURS = float(os.getenv("RETAIN_AFTER_UPLOAD_HOURS", "0"))
+RETAIN_FAILED_DAYS = float(os.getenv("RETAIN_FAILED_DAYS", "7"))
+# Un artefact dérivé utilisé récemment n'est jamais évincé (rendu en cours)
+EVICT_MIN_AGE = 600
+USAGE_TTL = 30
+
+CATEGORIES = ("audio", "audio_cache", "video", "thumbs", "thumbs_1080p", "profiles", "other")
+# Artefacts dérivés, régénérables : évincés du moins récemment utilisé au plus récent
+EVICTABLE = ("audio_cache", "thumbs_1080p", "profiles")
+
+class InsufficientStorage(Exception):
+    pass
+
+_usage_lock = threading.Lock()
+_usage_cache: tuple[float, dict] = (0.0, {})
+
+def _category(path: Path) -> str:
+    rel = path.relative_to(STORAGE_DIR).parts
+    if rel[0] == "audio":
+        return "audio_cache" if len(rel) > 2 and rel[1] == "cache" else "audio"
+    if rel[0] == "thumbs":
+        return "thumbs_1080p" if path.name.endswith("_1080p.jpg") else "thumbs"
+    if rel[0] in ("video", "profiles"):
+        return rel[0]
+    return "other"
+
+def _scan():
+    """
+    Parcourt storage/ : (octets par catégorie, fichiers par catégorie), chaque
+    fichier étant (mtime, taille, nombre de liens, chemin). Les liens durs (audio du job <-> cache TTS) ne sont comptés qu'une fois.
+    """
+    totals = dict.fromkeys(CATEGORIES, 0)
+    files: dict[str, list] = {c: [] for c in CATEGORIES}
+    seen = set()
+    for root, _, names in os.walk(STORAGE_DIR):
+        for name in names:
+            if name.endswith((".part", ".tmp")):
+                continue  # écriture en cours
+            path = Path(root) / name
+            try:
+                st = path.stat()
+            except FileNotFoundError:
+                continue
+            cat = _category(path)
+            files[cat].append((st.st_mtime, st.st_size, st.st_nlink, path))
+            if (st.st_dev, st.st_ino) in seen:
+                continue
+            seen.add((st.st_dev, st.st_ino))
+            totals[cat] += st.st_size
+    return totals, files
+
+def usage(fresh: bool = False) -> dict:
+    """
+    Octets occupés par catégorie (+ "total"), mis en cache USAGE_TTL secondes.
+    """
+    global _usage_cache
+    with _usage_lock:
+        at, cached = _usage_cache
+        if not fresh and cached and time.monotonic() - at < USAGE_TTL:
+            return dict(cached)
+        totals, _ = _scan()
+        totals["total"] = sum(totals.values())
+        _usage_cache = (time.monotonic(), totals)
+        return dict(totals)
+
+def last_usage() -> dict:
+    """
+    Dernière occupation calculée (balayage du worker), sans parcourir le disque :
+    pour /health et /metrics. Vide tant qu'aucun balayage n'a eu lieu dans ce process.
+    """
+    with _usage_lock:
+        return dict(_usage_cache[1])
+
+def _unlink(path) -> int:
+    try:
+        size = os.path.getsize(path)
+        os.unlink(path)
+        return size
+    except (FileNotFoundError, TypeError):
+        return 0
+
+def evict(target_bytes: int) -> int:
+    """
+    Évince les artefacts dérivés les moins récemment utilisés jusqu'à ce que
+    storage/ occupe au plus target_bytes. Renvoie les octets libérés.
+    """
+    totals, files = _scan()
+    total = sum(totals.values())
+    freed = 0
+    cutoff = time.time() - EVICT_MIN_AGE
+    candidates = sorted(f for cat in EVICTABLE for f in files[cat] if f[0] < cutoff)
+    for _, size, nlink, path in candidates:
+        if total - freed <= target_bytes:
+            break
+        if nlink > 1:
+            continue  # lien dur (cache partagé avec l'audio d'un job) : le supprimer ne libère rien
+        if _unlink(path):
+            freed += size
+    usage(fresh=True)
+    return freed
+
+def enforce_budget() -> int:
+    if not STORAGE_BUDGET_BYTES:
+        return 0
+    if usage()["total"] <= STORAGE_BUDGET_BYTES:
+        return 0
+    return evict(STORAGE_BUDGET_BYTES)
+
+def ensure_space(projected_bytes: int):
+    """
+    Vérifie qu'un fichier de projected_bytes tient dans le budget et sur le
+    disque (en évinçant des artefacts dérivés si besoin), sinon lève
+    InsufficientStorage : mieux vaut refuser un rendu que remplir le disque.
+    """
+    def shortfall() -> int:
+        missing = STORAGE_MIN_FREE_BYTES + projected_bytes - shutil.disk_usage(STORAGE_DIR).free
+        if STORAGE_BUDGET_BYTES:
+            missing = max(missing, usage()["total"] + projected_bytes - STORAGE_BUDGET_BYTES)
+        return missing
+
+    missing = shortfall()
+    if missing <= 0:
+        return
+    evict(max(0, usage(fresh=True)["total"] - missing))
+    if shortfall() > 0:
+        raise InsufficientStorage(
+            f"Espace disque insuffisant pour le rendu (~{projected_bytes // 1048576 + 1} Mo nécessaires)"
+        )
+
+def apply_retention(db, batch: int = 500) -> int:
+    """
+    Supprime vidéo et audio des jobs dont l'upload est confirmé
+    (après RETAIN_AFTER_UPLOAD_HOURS) ou en échec depuis RETAIN_FAILED_DAYS.
+    Les chemins sont remis à NULL. Renvoie les octets libérés.
+    """
+    from sqlalchemy import func
+    from models import Job  # import local : storage reste utilisable sans base
+
+    now = datetime.now(timezone.utc)
+    rules = [
+        (("PUBLISHED", "SCHEDULED"), now - timedelta(hours=RETAIN_AFTER_UPLOAD_HOURS)),
+        (("FAILED",), now - timedelta(days=RETAIN_FAILED_DAYS)),
+    ]
+    freed = 0
+    for statuses, cutoff in rules:
+        jobs = (
+            db.query(Job)
+              .filter(
+                  Job.status.in_(statuses),
+                  (Job.video_path.isnot(None)) | (Job.audio_path.isnot(None)),
+                  func.coalesce(Job.updated_at, Job.created_at) <= cutoff,
+              )
+              .limit(batch)
+              .all()
+        )
+        for job in jobs:
+            if job.status != "FAILED" and not job.youtube_video_id:
+                continue  # pas d'upload confirmé : on garde tout
+            freed += _unlink(job.video_path) + _unlink(job.audio_path)
+            job.video_path = None
+            job.audio_path = None
+        db.commit()
+    if freed:
+        usage(fresh=True)
+    return freed
+
+def sweep_orphans(db) -> int:
+    """
+    Supprime les miniatures (et leur 1080p) qu'aucun job ne référence plus.
+    Seuls les fichiers écrits par store_thumbnail sont concernés : les images
+    déposées à la main pour un /bulk sans ZIP restent en place.
+    """
+    from models import Job
+
+    referenced = {
+        os.path.realpath(p) for (p,) in db.query(Job.thumbnail_path).distinct() if p
+    }
+    db.rollback()
+    freed = 0
+    cutoff = time.time() - EVICT_MIN_AGE  # laisse le temps au job d'être créé
+    for path in THUMBS_DIR.iterdir():
+        if not path.is_file() or not _STORED_THUMB.fullmatch(path.name):
+            continue
+        try:
+            if path.stat().st_mtime >= cutoff or os.path.realpath(path) in referenced:
+                continue
+        except FileNotFoundError:
+            continue
+        freed += _unlink(path) + _unlink(path.with_name(path.stem + "_1080p.jpg"))
+    return freed
@@ -1,6 +1,14 @@
 ﻿# tts.py — edge-tts avec repli automatique gTTS si 403/erreur réseau
 import asyncio
+import concurrent.futures
+import hashlib
+import io
+import os
 import re
+import shutil
+import threading
+import uuid
+from pathlib import Path
 
 # 1) TTS Microsoft (edge-tts)
 import edge_tts
@@ -8,6 +16,28 @@ import edge_tts
 # 2) Repli Google Translate TTS
 from gtts import gTTS
 
+import metrics
+from storage import AUDIO_CACHE_DIR
+
+DEFAULT_VOICE = "fr-FR-DeniseNeural"
+
+# Cache audio adressé par contenu (storage/audio/cache) : hash(texte nettoyé, voix, rate)
+AUDIO_CACHE_MAX_BYTES = int(float(os.getenv("TTS_CACHE_MAX_MB", "2048")) * 1024 * 1024)
+
+cache_stats = {"hits": 0, "misses": 0, "evictions": 0}
+_cache_lock = threading.Lock()
+
+SYNTHESIZE_SECONDS = metrics.Histogram("autopub_synthesize_seconds", "Durée de synthesize() (hors cache)")
+TTS_CHUNKS = metrics.Counter("autopub_tts_chunks_total", "Morceaux synthétisés, par moteur", ("engine",))
+TTS_CACHE = metrics.Counter("autopub_tts_cache_total", "Consultations du cache audio", ("result",))
+
+# Scripts longs : découpés en morceaux synthétisés en parallèle
+TTS_CHUNK_CHARS = int(os.getenv("TTS_CHUNK_CHARS", "1500"))
+TTS_CHUNK_CONCURRENCY = max(1, int(os.getenv("TTS_CHUNK_CONCURRENCY", "4")))
+TTS_CHUNK_RETRIES = max(0, int(os.getenv("TTS_CHUNK_RETRIES", "2")))
+# Limite globale de flux edge-tts simultanés (tous jobs confondus)
+TTS_MAX_CONCURRENCY = max(1, int(os.getenv("TTS_MAX_CONCURRENCY", "8")))
+
 def _rate_from_speed(speed: float) -> str:
     """
     Convertit un multiplicateur (ex: 1.3) en rate edge-tts (ex: +30%).
@@ -44,34 +74,219 @@ def _sanitize_text(text: str) -> str:
     t = re.sub(r"\s+", " ", t).strip()
     return t or " "
 
-def _edge_tts_to_mp3(text: str, out_path: str, voice: str, speed: float):
+def _split_chunks(text: str, max_chars: int) -> list[str]:
+    """
+    Découpe le script en morceaux <= max_chars, en coupant d'abord
+    entre paragraphes, puis entre phrases, puis entre mots.
+    """
+    pieces = []
+    for para in re.split(r"\n\s*\n", text or ""):
+        for sentence in re.split(r"(?<=[.!?…])\s+", para.strip()):
+            sentence = sentence.strip()
+            while len(sentence) > max_chars:
+                cut = sentence.rfind(" ", 0, max_chars)
+                if cut <= 0:
+                    cut = max_chars
+                pieces.append(sentence[:cut].strip())
+                sentence = sentence[cut:].strip()
+            if sentence:
+                pieces.append(sentence)
+        pieces.append("")  # marque la fin du paragraphe
+
+    chunks, current = [], ""
+    for piece in pieces:
+        if not piece:
+            # on préfère finir un morceau sur une fin de paragraphe
+            if len(current) >= max_chars // 2:
+                chunks.append(current)
+                current = ""
+            continue
+        if current and len(current) + 1 + len(piece) > max_chars:
+            chunks.append(current)
+            current = piece
+        else:
+            current = f"{current} {piece}" if current else piece
+    if current:
+        chunks.append(current)
+    return chunks
+
+async def _edge_tts_bytes(text: str, voice: str, rate: str) -> bytes:
     """
     Génère un MP3 avec edge-tts (peut lever Exception si 403).
     """
-    rate = _rate_from_speed(speed)
-    communicate = edge_tts.Communicate(text, voice=voice or "fr-FR-DeniseNeural", rate=rate)
-    async def _run():
-        with open(out_path, "wb") as f:
-            async for chunk in communicate.stream():
-                if chunk["type"] == "audio":
-                    f.write(chunk["data"])
-    asyncio.run(_run())
+    communicate = edge_tts.Communicate(text, voice=voice or DEFAULT_VOICE, rate=rate)
+    buf = bytearray()
+    async for chunk in communicate.stream():
+        if chunk["type"] == "audio":
+            buf += chunk["data"]
+    if not buf:
+        raise RuntimeError("edge-tts n'a renvoyé aucun audio")
+    return bytes(buf)
 
-def _gtts_to_mp3(text: str, out_path: str, voice: str):
+def _gtts_bytes(text: str, voice: str) -> bytes:
     """
     Repli gTTS : MP3 rapide, qualité correcte.
     """
     lang = _detect_lang_from_voice(voice)
     clean = _sanitize_text(text)
-    gTTS(text=clean, lang=lang, slow=False).save(out_path)
+    fp = io.BytesIO()
+    gTTS(text=clean, lang=lang, slow=False).write_to_fp(fp)
+    return fp.getvalue()
 
-def synthesize(text: str, out_path: str, voice: str = "fr-FR-DeniseNeural", speed: float = 1.1, pitch: str | None = None):
+def _strip_id3(data: bytes) -> bytes:
+    # En-tête ID3v2 éventuel : il ne doit pas se retrouver au milieu du MP3
+    if len(data) >= 10 and data[:3] == b"ID3":
+        size = (data[6] & 0x7F) << 21 | (data[7] & 0x7F) << 14 | (data[8] & 0x7F) << 7 | (data[9] & 0x7F)
+        return data[10 + size:]
+    return data
+
+class _TTSService:
     """
-    Tente edge-tts ; en cas d’échec (ex: 403 sur Render), bascule vers gTTS automatiquement.
+    Boucle asyncio unique, dans son propre thread, partagée par tous les
+    workers : pas de asyncio.run() par job, et une limite de concurrence
+    commune pour les appels edge-tts.
     """
+    def __init__(self, max_concurrency: int):
+        self._max_concurrency = max_concurrency
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._sem: asyncio.Semaphore | None = None
+        self._lock = threading.Lock()
+
+    def _ensure_started(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                t = threading.Thread(target=loop.run_forever, name="autopub-tts-loop", daemon=True)
+                t.start()
+                self._sem = asyncio.Semaphore(self._max_concurrency)
+                self._loop = loop
+            return self._loop
+
+    def submit(self, coro) -> concurrent.futures.Future:
+        return asyncio.run_coroutine_threadsafe(coro, self._ensure_started())
+
+    async def _synthesize_chunk(self, text: str, voice: str, rate: str) -> bytes:
+        async with self._sem:
+            for attempt in range(TTS_CHUNK_RETRIES + 1):
+                try:
+                    data = await _edge_tts_bytes(text, voice, rate)
+                    TTS_CHUNKS.inc(engine="edge")
+                    return data
+                except Exception:
+                    if attempt < TTS_CHUNK_RETRIES:
+                        await asyncio.sleep(0.5 * 2 ** attempt)
+        # Repli automatique pour ce morceau seulement
+        # (utile sur Render quand edge-tts retourne 403)
+        data = await asyncio.to_thread(_gtts_bytes, text, voice)
+        TTS_CHUNKS.inc(engine="gtts")
+        return data
+
+    async def synthesize_to_file(self, chunks: list[str], out_path: str, voice: str, speed: float):
+        rate = _rate_from_speed(speed)
+        job_sem = asyncio.Semaphore(TTS_CHUNK_CONCURRENCY)
+
+        async def _one(text: str) -> bytes:
+            async with job_sem:
+                return await self._synthesize_chunk(text, voice, rate)
+
+        tasks = [asyncio.create_task(_one(c)) for c in chunks]
+        try:
+            # écrit chaque morceau dès qu'il est prêt (dans l'ordre),
+            # les écritures disque passant par un thread pour ne pas bloquer la boucle
+            f = await asyncio.to_thread(open, out_path, "wb")
+            try:
+                for task in tasks:
+                    data = await task
+                    await asyncio.to_thread(f.write, _strip_id3(data))
+            finally:
+                await asyncio.to_thread(f.close)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+
+_service = _TTSService(TTS_MAX_CONCURRENCY)
+
+def synthesize(text: str, out_path: str, voice: str = DEFAULT_VOICE, speed: float = 1.1, pitch: str | None = None):
+    """
+    Synthétise le script par morceaux en parallèle (edge-tts, repli gTTS
+    morceau par morceau), puis concatène les trames MP3 sans réencodage.
+    """
+    chunks = _split_chunks(text, TTS_CHUNK_CHARS) or [" "]
+    with SYNTHESIZE_SECONDS.time():
+        _service.submit(_service.synthesize_to_file(chunks, out_path, voice, speed)).result()
+
+# -----------------------
+# Cache audio
+# -----------------------
+def audio_cache_key(text: str, voice: str, speed: float) -> str:
+    h = hashlib.sha256()
+    for part in (_sanitize_text(text), voice or DEFAULT_VOICE, _rate_from_speed(speed)):
+        h.update(part.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+def _link_or_copy(src: Path, dst: str):
+    """
+    Publie src sous dst sans réécrire dst sur place (lien dur si possible).
+    """
+    tmp = f"{dst}.{uuid.uuid4().hex[:8]}.tmp"
+    try:
+        os.link(src, tmp)
+    except OSError:
+        shutil.copyfile(src, tmp)
+    os.replace(tmp, dst)
+
+def _evict_cache():
+    # LRU sur la date de modification (rafraîchie à chaque hit)
+    with _cache_lock:
+        entries = []
+        total = 0
+        for p in AUDIO_CACHE_DIR.glob("*.mp3"):
+            try:
+                st = p.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, p))
+            total += st.st_size
+        entries.sort()
+        for _, size, p in entries:
+            if total <= AUDIO_CACHE_MAX_BYTES:
+                break
+            try:
+                p.unlink()
+                cache_stats["evictions"] += 1
+            except FileNotFoundError:
+                pass
+            total -= size
+
+def synthesize_cached(text: str, out_path: str, voice: str = DEFAULT_VOICE, speed: float = 1.1, pitch: str | None = None) -> bool:
+    """
+    Comme synthesize(), mais réutilise le MP3 déjà produit pour le même
+    (texte, voix, vitesse). Renvoie True si l'audio vient du cache.
+    """
+    cached = AUDIO_CACHE_DIR / f"{audio_cache_key(text, voice, speed)}.mp3"
+    if cached.exists() and cached.stat().st_size > 0:
+        try:
+            os.utime(cached)
+            _link_or_copy(cached, out_path)
+            with _cache_lock:
+                cache_stats["hits"] += 1
+            TTS_CACHE.inc(result="hit")
+            return True
+        except FileNotFoundError:
+            pass  # évincé entre-temps : on resynthétise
+
+    with _cache_lock:
+        cache_stats["misses"] += 1
+    TTS_CACHE.inc(result="miss")
+    tmp = f"{cached}.{uuid.uuid4().hex[:8]}.part"
     try:
-        _edge_tts_to_mp3(text, out_path, voice, speed)
-        return
-    except Exception as e:
-        # Repli automatique — utile sur Render quand edge-tts retourne 403
-        _gtts_to_mp3(text, out_path, voice)
+        synthesize(text, tmp, voice=voice, speed=speed, pitch=pitch)
+        os.replace(tmp, cached)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    _link_or_copy(cached, out_path)
+    _evict_cache()
+    return False
@@ -1,11 +1,56 @@
 
 from moviepy.editor import ImageClip, AudioFileClip
+from moviepy.video.io.ffmpeg_reader import ffmpeg_parse_infos
 from PIL import Image
-import os
+import os, shutil, hashlib, logging, subprocess, threading, time, uuid
+
+import metrics
+import storage
 
 TARGET_W, TARGET_H = 1920, 1080
 
+# Moteur de rendu : "ffmpeg" (image fixe, rapide) ou "moviepy" (historique)
+RENDER_ENGINE = os.getenv("RENDER_ENGINE", "ffmpeg").strip().lower()
+# Image fixe : quelques images/s suffisent, x264 les compresse presque à zéro
+STILL_FPS = os.getenv("RENDER_STILL_FPS", "1")
+# "copy" garde le MP3 du TTS tel quel ; "aac" le réencode (léger)
+RENDER_AUDIO = os.getenv("RENDER_AUDIO", "copy").strip().lower()
+# Débits max de sortie (kb/s) : plafonnent l'encodage et servent à projeter la
+# taille d'un rendu (durée x débit) avant de le lancer (storage.ensure_space)
+AAC_KBPS = 128
+STILL_VIDEO_MAX_KBPS = 500    # ffmpeg, image fixe à RENDER_STILL_FPS
+MOVIEPY_VIDEO_MAX_KBPS = 2000  # repli MoviePy, 24 i/s
+CONTAINER_MARGIN = 4 * 1024 * 1024
+
+ENSURE_1080P_SECONDS = metrics.Histogram("autopub_ensure_1080p_seconds", "Durée de ensure_1080p()", ("cached",))
+RENDER_SECONDS = metrics.Histogram("autopub_render_video_seconds", "Durée de render_video(), par moteur", ("engine",))
+RENDERED_BYTES = metrics.Counter("autopub_rendered_bytes_total", "Octets de MP4 produits")
+RENDER_FALLBACKS = metrics.Counter("autopub_render_fallbacks_total", "Rendus ffmpeg échoués, refaits avec MoviePy")
+
+log = logging.getLogger(__name__)
+
+# Verrous par seau de hash (nombre fixe) : deux miniatures différentes partagent
+# rarement un verrou, et la table ne grossit pas avec le nombre de fichiers
+_normalize_locks = [threading.Lock() for _ in range(64)]
+
 def ensure_1080p(img_path: str) -> str:
+    """
+    Normalise la miniature en 1080p une seule fois : le résultat
+    (<miniature>_1080p.jpg) est réutilisé tant que la source n'a pas changé.
+    Avec le stockage par hash, tous les jobs d'une même image le partagent.
+    """
+    t0 = time.perf_counter()
+    out_path = os.path.splitext(img_path)[0] + "_1080p.jpg"
+    with _normalize_locks[hash(out_path) % len(_normalize_locks)]:
+        if os.path.exists(out_path) and os.path.getmtime(out_path) >= os.path.getmtime(img_path):
+            os.utime(out_path)  # LRU : date d'usage pour l'éviction (storage.evict)
+            ENSURE_1080P_SECONDS.observe(time.perf_counter() - t0, cached="yes")
+            return out_path
+        _normalize_1080p(img_path, out_path)
+    ENSURE_1080P_SECONDS.observe(time.perf_counter() - t0, cached="no")
+    return out_path
+
+def _normalize_1080p(img_path: str, out_path: str):
     img = Image.open(img_path).convert('RGB')
     img_ratio = img.width / img.height
     target_ratio = TARGET_W / TARGET_H
@@ -27,22 +72,123 @@ def ensure_1080p(img_path: str) -> str:
         left = (TARGET_W - new_w)//2
         canvas.paste(resized, (left, 0))
         out = canvas
-    out_path = os.path.splitext(img_path)[0] + "_1080p.jpg"
-    out.save(out_path, quality=95)
-    return out_path
+    tmp_path = f"{out_path}.{uuid.uuid4().hex[:8]}.tmp"
+    out.save(tmp_path, format="JPEG", quality=95)
+    os.replace(tmp_path, out_path)
 
-def render_video(thumbnail_path: str, audio_path: str, out_path: str):
-    fixed_thumb = ensure_1080p(thumbnail_path)
+def _ffmpeg_exe() -> str:
+    try:
+        import imageio_ffmpeg
+        return imageio_ffmpeg.get_ffmpeg_exe()
+    except Exception:
+        return shutil.which("ffmpeg") or "ffmpeg"
+
+def _render_ffmpeg(image_path: str, audio_path: str, out_path: str, threads: int):
+    """
+    Encode directement avec ffmpeg : l'image bouclée à très bas débit
+    d'images (tune stillimage) + l'audio copié sans décodage.
+    """
+    if RENDER_AUDIO == "copy":
+        audio_args = ["-c:a", "copy"]
+    else:
+        audio_args = ["-c:a", "aac", "-b:a", f"{AAC_KBPS}k"]
+    tmp_path = out_path + ".part"
+    cmd = [
+        _ffmpeg_exe(), "-hide_banner", "-loglevel", "error", "-y",
+        "-loop", "1", "-framerate", STILL_FPS, "-i", image_path,
+        "-i", audio_path,
+        "-map", "0:v:0", "-map", "1:a:0",
+        "-c:v", "libx264", "-preset", "veryfast", "-tune", "stillimage",
+        "-pix_fmt", "yuv420p", "-r", STILL_FPS,
+        "-maxrate", f"{STILL_VIDEO_MAX_KBPS}k", "-bufsize", f"{2 * STILL_VIDEO_MAX_KBPS}k",
+        "-threads", str(threads),
+        *audio_args,
+        "-shortest", "-movflags", "+faststart",
+        "-f", "mp4", tmp_path,
+    ]
+    try:
+        subprocess.run(cmd, check=True, capture_output=True)
+        os.replace(tmp_path, out_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def _render_moviepy(image_path: str, audio_path: str, out_path: str, threads: int):
     audio = AudioFileClip(audio_path)
-    image = ImageClip(fixed_thumb, duration=audio.duration)
+    image = ImageClip(image_path, duration=audio.duration)
     video = image.set_audio(audio).set_fps(24)
     video.write_videofile(
         out_path,
         codec="libx264",
         audio_codec="aac",
+        audio_bitrate=f"{AAC_KBPS}k",
+        ffmpeg_params=["-maxrate", f"{MOVIEPY_VIDEO_MAX_KBPS}k", "-bufsize", f"{2 * MOVIEPY_VIDEO_MAX_KBPS}k"],
         fps=24,
         preset="veryfast",
-        threads=2,
+        threads=threads,
         verbose=False,
         logger=None
     )
+
+def projected_size(audio_path: str, engine: str, seconds: float | None = None) -> int:
+    """
+    Taille maximale attendue du MP4 : durée de l'audio x débits plafonnés du
+    moteur (l'audio copié tel quel compte pour sa taille réelle).
+    """
+    if seconds is None:
+        seconds = ffmpeg_parse_infos(audio_path)["duration"]
+    if engine == "ffmpeg":
+        video_kbps = STILL_VIDEO_MAX_KBPS
+        audio_bytes = os.path.getsize(audio_path) if RENDER_AUDIO == "copy" else AAC_KBPS * 125 * seconds
+    else:
+        video_kbps = MOVIEPY_VIDEO_MAX_KBPS
+        audio_bytes = AAC_KBPS * 125 * seconds
+    return int(audio_bytes + video_kbps * 125 * seconds) + CONTAINER_MARGIN
+
+def render_key(audio_key: str, thumbnail_path: str, engine: str | None = None) -> str:
+    """
+    Empreinte des entrées d'un rendu : audio (sa propre empreinte), miniature
+    (nommée par son hash) et réglages du moteur. Même empreinte => même vidéo.
+    """
+    try:
+        thumb_size = os.path.getsize(thumbnail_path)
+    except (OSError, TypeError):
+        thumb_size = -1
+    h = hashlib.sha256()
+    for part in (audio_key, os.path.basename(thumbnail_path or ""), str(thumb_size),
+                 engine or RENDER_ENGINE, STILL_FPS, RENDER_AUDIO, f"{TARGET_W}x{TARGET_H}",
+                 AAC_KBPS, STILL_VIDEO_MAX_KBPS, MOVIEPY_VIDEO_MAX_KBPS):
+        h.update(str(part).encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+def render_video(thumbnail_path: str, audio_path: str, out_path: str, threads: int = 2, engine: str | None = None) -> str:
+    """
+    Rend la vidéo et renvoie le moteur réellement utilisé ("ffmpeg" ou "moviepy",
+    après un repli) : il fait partie de l'empreinte du rendu (render_key).
+    """
+    t0 = time.perf_counter()
+    fixed_thumb = ensure_1080p(thumbnail_path)
+    seconds = ffmpeg_parse_infos(audio_path)["duration"]
+    used = "moviepy"
+    if (engine or RENDER_ENGINE) == "ffmpeg":
+        # hors du try : un manque de place ne doit pas déclencher le repli
+        storage.ensure_space(projected_size(audio_path, "ffmpeg", seconds))
+        try:
+            _render_ffmpeg(fixed_thumb, audio_path, out_path, threads)
+            used = "ffmpeg"
+        except Exception as e:
+            # Repli : ffmpeg absent ou entrée exotique -> MoviePy (5 à 10x plus lent) :
+            # on le signale, sinon un ffmpeg cassé ne se voit qu'à la lenteur
+            stderr = getattr(e, "stderr", None)
+            if isinstance(stderr, bytes):
+                stderr = stderr.decode("utf-8", "replace")
+            log.warning("rendu ffmpeg échoué (%s), repli MoviePy : %s", e, (stderr or "").strip()[-2000:])
+            RENDER_FALLBACKS.inc()
+    if used == "moviepy":
+        # sortie MoviePy bien plus lourde : nouvelle projection
+        storage.ensure_space(projected_size(audio_path, "moviepy", seconds))
+        _render_moviepy(fixed_thumb, audio_path, out_path, threads)
+    RENDER_SECONDS.observe(time.perf_counter() - t0, engine=used)
+    RENDERED_BYTES.inc(os.path.getsize(out_path))
+    return used
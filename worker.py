@@ -1,28 +1,135 @@
 # worker.py — traitement + upload YouTube par utilisateur + compat Render
-import threading, time, os, smtplib
+import threading, queue, time, os, smtplib, io, cProfile, pstats, signal, socket, uuid, logging, math
+from collections import deque
+from contextlib import contextmanager
 from email.mime.text import MIMEText
-from datetime import datetime
-from pathlib import Path
+from datetime import datetime, timedelta, timezone
+from typing import Optional
 import pytz
+from dotenv import load_dotenv
 
+from sqlalchemy import update, func, insert, select, or_
 from sqlalchemy.orm import Session
 
-from database import SessionLocal
-from models import Job, User
-from tts import synthesize
-from video import render_video
+# Worker autonome (python worker.py) : .env chargé avant les modules locaux,
+# qui lisent leur configuration à l'import ; sans effet si l'API l'a déjà fait
+load_dotenv()
 
-from youtube_uploader import upload_to_youtube
+from database import SessionLocal, IS_POSTGRES, engine, ensure_schema, pg_notify, pg_listen_forever
+from models import Job, JobEvent, User
+from tts import synthesize_cached, audio_cache_key
+from video import render_video, ensure_1080p, render_key
+import storage
+from storage import AUDIO_DIR, VIDEO_DIR, PROFILES_DIR
 
-# Dossiers (persistants si APP_DATA_DIR défini)
-DATA_DIR = Path(os.getenv("APP_DATA_DIR", ".")).resolve()
-STORAGE_DIR = (DATA_DIR / "storage").resolve()
-(STORAGE_DIR / "audio").mkdir(parents=True, exist_ok=True)
-(STORAGE_DIR / "video").mkdir(parents=True, exist_ok=True)
+from youtube_uploader import upload_to_youtube, QuotaExceeded, quota_exhausted_users
+from events import job_event, publish
+import metrics
+
+log = logging.getLogger(__name__)
 
 TZ = pytz.timezone(os.getenv("TIMEZONE", "UTC"))
 _worker_started = False
 
+# Pipeline à étages : TTS (réseau) -> rendu (CPU) -> upload (réseau).
+# Chaque étage a sa propre concurrence ; des files bornées les relient.
+CPU_COUNT = os.cpu_count() or 1
+TTS_CONCURRENCY = max(1, int(os.getenv("TTS_CONCURRENCY", "2")))
+# WORKER_CONCURRENCY reste accepté comme alias historique pour le rendu
+# valeur vide (ex. .env.example passé tel quel à docker --env-file) = non définie
+RENDER_CONCURRENCY = max(1, int(os.getenv("RENDER_CONCURRENCY") or os.getenv("WORKER_CONCURRENCY") or CPU_COUNT))
+UPLOAD_CONCURRENCY = max(1, int(os.getenv("UPLOAD_CONCURRENCY", "2")))
+STAGE_QUEUE_SIZE = max(1, int(os.getenv("STAGE_QUEUE_SIZE", "4")))
+# Budget CPU partagé entre les rendus simultanés (threads ffmpeg par rendu)
+RENDER_THREADS = max(1, int(os.getenv("RENDER_THREADS") or 0) or CPU_COUNT // RENDER_CONCURRENCY)
+
+_render_queue: "queue.Queue[int]" = queue.Queue(maxsize=STAGE_QUEUE_SIZE)
+_upload_queue: "queue.Queue[int]" = queue.Queue(maxsize=STAGE_QUEUE_SIZE)
+
+# Cycle de vie du stockage (rétention, budget) : période du balayage (s)
+STORAGE_SWEEP_INTERVAL = float(os.getenv("STORAGE_SWEEP_INTERVAL", "600"))
+
+# Upload : fréquence max des mises à jour de progression (s)
+UPLOAD_PROGRESS_INTERVAL = float(os.getenv("UPLOAD_PROGRESS_INTERVAL", "5"))
+
+# Réveil événementiel : poke_worker() (même process) ou NOTIFY Postgres
+# (autres process). Le poll de secours est long : la base reste au repos.
+WORKER_IDLE_POLL = float(os.getenv("WORKER_IDLE_POLL", "60"))
+NOTIFY_CHANNEL = "autopub_jobs"
+_wake_cond = threading.Condition()
+_wake_gen = 0
+
+# Baux : chaque job réservé appartient à un worker jusqu'à lease_expires_at,
+# prolongé par heartbeat. Un bail expiré (worker mort) remet le job en file.
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+LEASE_SECONDS = max(10.0, float(os.getenv("LEASE_SECONDS", "120")))
+HEARTBEAT_INTERVAL = LEASE_SECONDS / 3
+REAPER_INTERVAL = LEASE_SECONDS / 2
+
+class LeaseLost(Exception):
+    """
+    Le bail a expiré et le job a été repris ailleurs : on cesse d'y écrire.
+    """
+
+_lost_leases: set[int] = set()
+
+def _lease_until() -> datetime:
+    return datetime.now(timezone.utc) + timedelta(seconds=LEASE_SECONDS)
+
+def _end_transaction(db: Session):
+    """
+    Termine la transaction de lecture ouverte par l'accès aux attributs du job
+    avant une étape longue (TTS, rendu, upload) : la connexion retourne au pool
+    au lieu de rester « idle in transaction ». Les valeurs utiles doivent avoir
+    été copiées avant (les attributs sont expirés).
+    """
+    db.commit()
+
+def _commit(db: Session, job: Job):
+    # Valide puis pousse le nouvel état aux tableaux de bord (SSE)
+    if job.id in _lost_leases:
+        raise LeaseLost(job.id)
+    event = job_event(job)
+    db.commit()
+    publish(event)
+
+# -----------------------
+# Chronologie des étapes (table job_events)
+# -----------------------
+@contextmanager
+def _span(job_id: int, stage: str):
+    """
+    Enregistre une étape : début, fin, durée, octets (rec["bytes"]) et issue.
+    Écrit sur sa propre connexion : la ligne survit au rollback d'un échec.
+    """
+    rec = {"outcome": "ok", "bytes": None, "detail": None}
+    started = datetime.now(timezone.utc)
+    t0 = time.perf_counter()
+    try:
+        yield rec
+    except Exception as e:
+        rec["outcome"], rec["detail"] = "error", str(e)[:1000]
+        raise
+    finally:
+        _record_span(job_id, stage, started, time.perf_counter() - t0, rec)
+
+def _record_span(job_id: int, stage: str, started: datetime, elapsed: float, rec: dict):
+    try:
+        with engine.begin() as conn:
+            conn.execute(insert(JobEvent).values(
+                job_id=job_id, stage=stage, outcome=rec["outcome"],
+                started_at=started, ended_at=started + timedelta(seconds=elapsed),
+                duration_ms=int(elapsed * 1000), bytes=rec["bytes"], detail=rec["detail"],
+            ))
+    except Exception:
+        pass  # la chronologie ne doit jamais faire échouer un job
+
+def _file_size(path: Optional[str]) -> Optional[int]:
+    try:
+        return os.path.getsize(path) if path else None
+    except OSError:
+        return None
+
 # -----------------------
 # Email (facultatif)
 # -----------------------
@@ -55,7 +162,7 @@ def handle_upload_for_job(db: Session, job: Job):
     try:
         job.status = "UPLOADING"
         job.progress_msg = "Envoi vers YouTube…"
-        db.commit()
+        _commit(db, job)
 
         tags_list = []
         if job.tags:
@@ -65,7 +172,24 @@ def handle_upload_for_job(db: Session, job: Job):
         if job.publish_iso and job.publish_iso.strip():
             publish_dt_utc = datetime.fromisoformat(job.publish_iso.replace("Z", "+00:00"))
 
-        video_id = upload_to_youtube(
+        last_report = 0.0
+        session_uri = job.upload_session_uri
+
+        def on_progress(uri: str, offset: int, total: int):
+            # la session est enregistrée dès sa création pour pouvoir reprendre
+            nonlocal last_report, session_uri
+            new_session = session_uri != uri
+            session_uri = uri
+            job.upload_session_uri = uri
+            job.upload_offset = offset
+            now = time.monotonic()
+            if new_session or offset >= total or now - last_report >= UPLOAD_PROGRESS_INTERVAL:
+                last_report = now
+                pct = int(offset * 100 / total) if total else 100
+                job.progress_msg = f"Envoi vers YouTube… {pct}% ({offset // 1048576}/{total // 1048576} Mo)"
+                _commit(db, job)
+
+        upload_args = dict(
             user_id=job.user_id,
             video_path=job.video_path,
             title=job.title,
@@ -73,8 +197,13 @@ def handle_upload_for_job(db: Session, job: Job):
             tags=tags_list,
             publish_time=publish_dt_utc,
             thumbnail_path=job.thumbnail_path,
+            resume_uri=session_uri,
         )
+        _end_transaction(db)
+        video_id = upload_to_youtube(**upload_args, on_progress=on_progress)
         job.youtube_video_id = video_id
+        job.upload_session_uri = None
+        job.upload_offset = 0
 
         if publish_dt_utc is None:
             job.status = "PUBLISHED"
@@ -82,86 +211,695 @@ def handle_upload_for_job(db: Session, job: Job):
         else:
             job.status = "SCHEDULED"
             job.progress_msg = f"Uploadé en privé. Publication programmée pour {publish_dt_utc} UTC."
-        db.commit()
+        _commit(db, job)
+
+    except QuotaExceeded as e:
+        # vidéo conservée : l'upload (seul) sera relancé à la remise à zéro du quota
+        job.status = "DEFERRED"
+        job.retry_at = e.retry_at
+        job.progress_msg = str(e)
+        _commit(db, job)
+        _wake_local()
 
     except Exception as e:
         job.status = "FAILED"
         job.progress_msg = f"Upload échoué : {e}"
-        db.commit()
+        _commit(db, job)
 
 # -----------------------
-# Traitement d’un job
+# Étages d’un job
 # -----------------------
-def _process_job(db: Session, job: Job):
-    try:
+# -----------------------
+# Points de reprise : chaque artefact garde l'empreinte de ses entrées
+# -----------------------
+RESUME_STAGES = ("tts", "render", "upload")
+
+def resume_stage(job: Job) -> str:
+    """
+    Premier étage à (re)faire : "tts", "render" ou "upload". Un artefact est
+    réutilisé s'il existe, n'est pas vide et provient des mêmes entrées.
+    La vidéo est testée d'abord : valide, elle rend l'audio inutile.
+    """
+    audio_key = audio_cache_key(job.script_text, job.voice, job.speed)
+    if job.video_key and job.video_key == render_key(audio_key, job.thumbnail_path) and _file_size(job.video_path):
+        return "upload"
+    if job.audio_key == audio_key and _file_size(job.audio_path):
+        return "render"
+    return "tts"
+
+def _stage_checkpoint(db: Session, job: Job):
+    # Étages déjà faits : rien à recalculer, on passe directement au suivant
+    start = resume_stage(job)
+    for stage in RESUME_STAGES[:RESUME_STAGES.index(start)]:
+        with _span(job.id, stage) as rec:
+            rec["outcome"], rec["detail"] = "skipped", "checkpoint"
+    if start == "upload":
+        job.status = "DONE"
+        job.progress_msg = "Vidéo déjà prête (point de reprise). Passage à l’upload YouTube…"
+    else:
         job.status = "RENDERING"
-        job.progress_msg = "Synthèse audio + rendu vidéo…"
-        db.commit()
+        job.progress_msg = "Audio déjà prêt (point de reprise). En attente du rendu vidéo…"
+    _commit(db, job)
 
-        # 1) TTS
-        audio_path = str(STORAGE_DIR / "audio" / f"{job.id}.mp3")
-        synthesize(
-            job.script_text,
+def _stage_tts(db: Session, job: Job):
+    job.status = "RENDERING"
+    job.progress_msg = "Synthèse audio…"
+    job.audio_key = None  # invalide tant que la nouvelle synthèse n'est pas terminée
+    _commit(db, job)
+
+    job_id, text, voice, speed = job.id, job.script_text, job.voice, job.speed
+    _end_transaction(db)
+    audio_path = str(AUDIO_DIR / f"{job_id}.mp3")
+    with _span(job_id, "tts") as rec:
+        from_cache = synthesize_cached(
+            text,
             audio_path,
-            voice=job.voice,
-            speed=job.speed,
+            voice=voice,
+            speed=speed,
             pitch=None
         )
-        job.audio_path = audio_path
-        db.commit()
+        rec["bytes"] = _file_size(audio_path)
+        rec["detail"] = "cache" if from_cache else None
+    job.audio_path = audio_path
+    job.audio_key = audio_cache_key(text, voice, speed)
+    if from_cache:
+        job.progress_msg = "Audio repris du cache. En attente du rendu vidéo…"
+    else:
+        job.progress_msg = "Audio prêt. En attente du rendu vidéo…"
+    _commit(db, job)
 
-        # 2) Rendu vidéo
-        video_path = str(STORAGE_DIR / "video" / f"{job.id}.mp4")
-        render_video(job.thumbnail_path, audio_path, video_path)
-        job.video_path = video_path
+def _stage_render(db: Session, job: Job):
+    job.status = "RENDERING"
+    job.progress_msg = "Rendu vidéo…"
+    job.video_key = None
+    # nouvel encodage = nouveaux octets (threads, moteur) : une session d'upload
+    # résumable ouverte pour l'ancienne vidéo ne doit pas être reprise avec celle-ci
+    job.upload_session_uri = None
+    job.upload_offset = 0
+    _commit(db, job)
 
-        # 3) Prêt localement
-        job.status = "DONE"
-        job.progress_msg = "Vidéo prête localement. Passage à l’upload YouTube…"
-        db.commit()
+    job_id, thumb, audio_path = job.id, job.thumbnail_path, job.audio_path
+    audio_key = job.audio_key or audio_cache_key(job.script_text, job.voice, job.speed)
+    _end_transaction(db)
+    video_path = str(VIDEO_DIR / f"{job_id}.mp4")
+    with _span(job_id, "ensure_1080p") as rec:
+        # résultat mis en cache : render_video() le retrouve immédiatement
+        rec["bytes"] = _file_size(ensure_1080p(thumb))
+    with _span(job_id, "encode") as rec:
+        engine = render_video(thumb, audio_path, video_path, threads=RENDER_THREADS)
+        rec["bytes"] = _file_size(video_path)
+        rec["detail"] = engine
+    job.video_path = video_path
+    # moteur réel dans l'empreinte : une sortie du repli MoviePy n'est pas un
+    # point de reprise valide quand ffmpeg est configuré
+    job.video_key = render_key(audio_key, thumb, engine)
 
-        # 4) Upload
+    # Prêt localement
+    job.status = "DONE"
+    job.progress_msg = "Vidéo prête localement. Passage à l’upload YouTube…"
+    _commit(db, job)
+
+def _stage_upload(db: Session, job: Job):
+    job_id = job.id
+    with _span(job_id, "upload") as rec:
+        offset = job.upload_offset or 0  # reprise : seuls les octets restants partent
         handle_upload_for_job(db, job)
+        if job.status == "FAILED":
+            rec["outcome"], rec["detail"] = "error", (job.progress_msg or "")[:1000]
+        elif job.status == "DEFERRED":
+            rec["outcome"], rec["detail"] = "deferred", job.progress_msg
+        else:
+            size = _file_size(job.video_path)
+            rec["bytes"] = size - offset if size is not None else None
+    if job.status == "DEFERRED":
+        return
 
-        # 5) Email (optionnel)
-        user = db.query(User).get(job.user_id)
-        if user:
-            vid = job.youtube_video_id or "—"
+    # Email (optionnel)
+    user = db.query(User).get(job.user_id)
+    if user:
+        vid = job.youtube_video_id or "—"
+        with _span(job_id, "email"):
             send_email(
                 subject="AutoPub — Vidéo envoyée sur YouTube",
                 body=f"Titre: {job.title}\nStatut: {job.status}\nMessage: {job.progress_msg}\nYouTube: https://youtube.com/watch?v={vid}",
                 to_email=user.email
             )
 
+def _fail_job(db: Session, job: Job, e: Exception):
+    db.rollback()
+    job.status = "FAILED"
+    job.progress_msg = str(e)
+    _commit(db, job)
+
+def _run_stage(stage, db: Session, job: Job) -> bool:
+    job_id = job.id
+    started, t0 = datetime.now(timezone.utc), time.perf_counter()
+    profiler = _start_profile() if job.profile else None
+    try:
+        stage(db, job)
+        return True
+    except LeaseLost:
+        db.rollback()
+        return False
     except Exception as e:
-        job.status = "FAILED"
-        job.progress_msg = str(e)
-        db.commit()
+        try:
+            _fail_job(db, job, e)
+        except LeaseLost:
+            db.rollback()
+        return False
+    finally:
+        if profiler is not None:
+            _save_profile(profiler, job_id, stage.__name__.replace("_stage_", ""), started, time.perf_counter() - t0)
 
 # -----------------------
-# Boucle
+# Profilage opt-in (Job.profile)
 # -----------------------
-def _loop():
+def _start_profile() -> Optional[cProfile.Profile]:
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        return None  # Python 3.12+ : un seul profileur actif à la fois
+    return profiler
+
+def _save_profile(profiler: cProfile.Profile, job_id: int, stage: str, started: datetime, elapsed: float):
+    """
+    Écrit profiles/<job>_<étage>.prof (pour snakeviz / pstats) et un résumé
+    texte, référencé dans la chronologie du job.
+    Seul le thread du worker est profilé (la synthèse edge-tts tourne sur
+    la boucle asyncio du service TTS et apparaît comme une attente).
+    """
+    profiler.disable()
+    base = PROFILES_DIR / f"{job_id}_{stage}"
+    profiler.dump_stats(f"{base}.prof")
+    out = io.StringIO()
+    stats = pstats.Stats(profiler, stream=out)
+    stats.sort_stats("cumulative").print_stats(40)
+    with open(f"{base}.txt", "w", encoding="utf-8") as f:
+        f.write(out.getvalue())
+    rec = {"outcome": "ok", "bytes": _file_size(f"{base}.prof"), "detail": f"/storage/profiles/{base.name}.txt"}
+    _record_span(job_id, f"profile_{stage}", started, elapsed, rec)
+
+# -----------------------
+# Traitement complet d’un job (séquentiel, hors pipeline)
+# -----------------------
+def _process_job(db: Session, job: Job):
+    stages = (_stage_tts, _stage_render, _stage_upload)
+    start = RESUME_STAGES.index(resume_stage(job))
+    if start and not _run_stage(_stage_checkpoint, db, job):
+        return
+    for stage in stages[start:]:
+        if not _run_stage(stage, db, job):
+            return
+
+# -----------------------
+# Ordonnancement des jobs READY
+# -----------------------
+# fifo : plus ancien d'abord | edf : échéance la plus proche d'abord |
+# fair : partage équitable (pondéré) entre utilisateurs
+SCHEDULER_POLICIES = ("fifo", "edf", "fair")
+SCHEDULER_POLICY = os.getenv("SCHEDULER_POLICY", "fifo").strip().lower()
+if SCHEDULER_POLICY not in SCHEDULER_POLICIES:
+    SCHEDULER_POLICY = "fifo"
+# Jobs en cours max par utilisateur (0 = illimité)
+USER_MAX_CONCURRENCY = max(0, int(os.getenv("USER_MAX_CONCURRENCY", "0")))
+# Poids du partage équitable : "user_id:poids,..." (1 par défaut)
+def _parse_user_weights(raw: str) -> dict[int, float]:
+    # une entrée invalide est ignorée (avec un avertissement) plutôt que
+    # d'empêcher l'API et le worker de démarrer
+    weights = {}
+    for item in filter(None, (i.strip() for i in raw.split(","))):
+        try:
+            k, v = item.split(":", 1)
+            user_id, weight = int(k), float(v)
+            if not (math.isfinite(weight) and weight > 0):
+                raise ValueError
+        except ValueError:
+            log.warning("USER_WEIGHTS : entrée ignorée %r (attendu user_id:poids > 0)", item)
+            continue
+        weights[user_id] = weight
+    return weights
+
+USER_WEIGHTS = _parse_user_weights(os.getenv("USER_WEIGHTS", ""))
+# Sans date de publication : échéance = création + marge (s), pour ne pas affamer ces jobs
+EDF_IMMEDIATE_SLACK = float(os.getenv("EDF_IMMEDIATE_SLACK", "3600"))
+
+# Statuts qui occupent le pipeline (réservés, pas encore terminés)
+ACTIVE_STATUSES = ("RENDERING", "DONE", "UPLOADING")
+
+QUEUE_WAIT_SECONDS = metrics.Histogram("autopub_queue_wait_seconds", "Attente READY -> réservation, par politique", ("policy",))
+INFLIGHT_JOBS = metrics.Gauge("autopub_jobs_inflight", "Jobs en cours dans le pipeline de ce process, par utilisateur", ("user_id",))
+STAGE_QUEUE_DEPTH = metrics.Gauge("autopub_stage_queue_depth", "Jobs en attente entre deux étages", ("stage",))
+STORAGE_BYTES = metrics.Gauge("autopub_storage_bytes", "Octets occupés dans storage/, par catégorie", ("category",))
+
+_claim_lock = threading.Lock()
+_sched_lock = threading.Lock()
+_sched_stats: dict[str, dict] = {}
+
+def job_deadline(publish_iso: Optional[str], created_at: Optional[datetime] = None) -> Optional[datetime]:
+    """
+    Échéance EDF d'un job (UTC) : sa date de publication si elle est programmée,
+    sinon sa date de création + EDF_IMMEDIATE_SLACK.
+    """
+    publish_iso = (publish_iso or "").strip()
+    if publish_iso:
+        try:
+            dt = datetime.fromisoformat(publish_iso.replace("Z", "+00:00"))
+        except ValueError:
+            return None
+        return dt.astimezone(timezone.utc) if dt.tzinfo else dt.replace(tzinfo=timezone.utc)
+    return (created_at or datetime.now(timezone.utc)) + timedelta(seconds=EDF_IMMEDIATE_SLACK)
+
+def _as_utc(dt: Optional[datetime]) -> Optional[datetime]:
+    # SQLite renvoie des datetimes naïfs (déjà en UTC)
+    if dt is None:
+        return None
+    return dt if dt.tzinfo else dt.replace(tzinfo=timezone.utc)
+
+def _record_wait(policy: str, job: Job):
+    now = datetime.now(timezone.utc)
+    created = _as_utc(job.created_at)
+    wait = max(0.0, (now - created).total_seconds()) if created else 0.0
+    deadline = _as_utc(job.deadline_at)
+    with _sched_lock:
+        st = _sched_stats.setdefault(policy, {"claimed": 0, "late": 0, "wait_total": 0.0, "wait_max": 0.0, "recent": deque(maxlen=1000)})
+        st["claimed"] += 1
+        st["wait_total"] += wait
+        st["wait_max"] = max(st["wait_max"], wait)
+        st["recent"].append(wait)
+        if deadline is not None and now > deadline:
+            st["late"] += 1
+    QUEUE_WAIT_SECONDS.observe(wait, policy=policy)
+
+def scheduler_stats() -> dict:
+    """
+    Attente en file (création -> réservation) par politique, depuis le démarrage.
+    late = jobs réservés après leur échéance.
+    """
+    out = {}
+    with _sched_lock:
+        for policy, st in _sched_stats.items():
+            recent = sorted(st["recent"])
+            out[policy] = {
+                "claimed": st["claimed"],
+                "late": st["late"],
+                "wait_avg_s": round(st["wait_total"] / st["claimed"], 3) if st["claimed"] else 0.0,
+                "wait_p95_s": round(recent[int(0.95 * (len(recent) - 1))], 3) if recent else 0.0,
+                "wait_max_s": round(st["wait_max"], 3),
+            }
+    return {"policy": SCHEDULER_POLICY, "user_max_concurrency": USER_MAX_CONCURRENCY, "policies": out}
+
+def _inflight_by_user(db: Session) -> dict[int, int]:
+    rows = (
+        db.query(Job.user_id, func.count(Job.id))
+          .filter(Job.status.in_(ACTIVE_STATUSES))
+          .group_by(Job.user_id)
+          .all()
+    )
+    return {user_id: n for user_id, n in rows}
+
+def _pick_fair_user(db: Session, inflight: dict[int, int], blocked: set[int]) -> Optional[int]:
+    # utilisateur le moins servi (jobs en cours / poids), puis le plus ancien en attente
+    heads = (
+        db.query(Job.user_id, func.min(Job.created_at))
+          .filter(Job.status == "READY")
+          .group_by(Job.user_id)
+          .all()
+    )
+    best = None
+    for user_id, oldest in heads:
+        n = inflight.get(user_id, 0)
+        if user_id in blocked or (USER_MAX_CONCURRENCY and n >= USER_MAX_CONCURRENCY):
+            continue
+        key = (n / USER_WEIGHTS.get(user_id, 1.0), _as_utc(oldest) or datetime.min.replace(tzinfo=timezone.utc))
+        if best is None or key < best[0]:
+            best = (key, user_id)
+    return best[1] if best else None
+
+def _next_ready_query(db: Session, policy: str):
+    """
+    Requête du prochain job READY selon la politique, ou None si rien n'est éligible.
+    """
+    q = db.query(Job.id).filter(Job.status == "READY")
+    # quota YouTube épuisé : rendre ces vidéos maintenant ne servirait à rien
+    blocked = quota_exhausted_users()
+    inflight = _inflight_by_user(db) if (policy == "fair" or USER_MAX_CONCURRENCY) else {}
+    if policy == "fair":
+        user_id = _pick_fair_user(db, inflight, blocked)
+        if user_id is None:
+            return None
+        q = q.filter(Job.user_id == user_id)
+    else:
+        if USER_MAX_CONCURRENCY:
+            blocked |= {u for u, n in inflight.items() if n >= USER_MAX_CONCURRENCY}
+        if blocked:
+            q = q.filter(Job.user_id.notin_(blocked))
+    if policy == "edf":
+        # échéance la plus proche ; jobs sans échéance (anciennes lignes) en dernier
+        q = q.order_by(Job.deadline_at.is_(None), Job.deadline_at.asc(), Job.created_at.asc(), Job.id.asc())
+    else:
+        q = q.order_by(Job.created_at.asc(), Job.id.asc())
+    return q
+
+# -----------------------
+# Réservation atomique d’un job
+# -----------------------
+def _claim_next_job(db: Session):
+    """
+    Réserve le prochain job READY (selon SCHEDULER_POLICY) pour ce worker.
+    L'UPDATE conditionnel (status='READY') garantit qu'un seul worker gagne,
+    même entre plusieurs processus ; sur Postgres, SKIP LOCKED évite en plus
+    que les workers se bloquent sur la même ligne.
+    Le verrou local rend le plafond par utilisateur exact dans un process
+    (entre process, il peut être dépassé brièvement).
+    """
+    policy = SCHEDULER_POLICY
+    with _claim_lock:
+        while True:
+            q = _next_ready_query(db, policy)
+            if q is not None and IS_POSTGRES:
+                q = q.with_for_update(skip_locked=True)
+            row = q.first() if q is not None else None
+            if not row:
+                db.rollback()
+                return None
+            res = db.execute(
+                update(Job)
+                  .where(Job.id == row.id, Job.status == "READY")
+                  .values(status="RENDERING", progress_msg="Synthèse audio…",
+                          lease_owner=WORKER_ID, lease_expires_at=_lease_until())
+            )
+            db.commit()
+            if res.rowcount == 1:
+                job = db.get(Job, row.id)
+                _record_wait(policy, job)
+                return job
+            # un autre worker l'a pris entre-temps : on réessaie
+
+# -----------------------
+# Réveil du worker
+# -----------------------
+def _wake_local():
+    global _wake_gen
+    with _wake_cond:
+        _wake_gen += 1
+        _wake_cond.notify_all()
+
+def _wait_for_work(seen_gen: int):
+    # Si un poke est arrivé depuis seen_gen, on repart tout de suite
+    with _wake_cond:
+        _wake_cond.wait_for(lambda: _wake_gen != seen_gen, timeout=WORKER_IDLE_POLL)
+
+def _pg_listen_loop():
+    # Relaye les NOTIFY Postgres (jobs créés par une autre instance de l'API)
+    pg_listen_forever(NOTIFY_CHANNEL, lambda _payload: _wake_local(), WORKER_IDLE_POLL)
+
+# -----------------------
+# Boucles des étages
+# -----------------------
+_inflight: dict[int, int] = {}  # job_id -> user_id
+_inflight_lock = threading.Lock()
+
+def _enter_pipeline(job_id: int, user_id: int):
+    with _inflight_lock:
+        _inflight[job_id] = user_id
+        _lost_leases.discard(job_id)
+    INFLIGHT_JOBS.inc(user_id=user_id)
+
+def _leave_pipeline(job_id: int):
+    with _inflight_lock:
+        user_id = _inflight.pop(job_id, None)
+        _lost_leases.discard(job_id)
+    if user_id is not None:
+        INFLIGHT_JOBS.dec(user_id=user_id)
+    _release_lease(job_id)
+    if SCHEDULER_POLICY == "fair" or USER_MAX_CONCURRENCY:
+        # une place se libère : des jobs READY bloqués par le plafond deviennent éligibles
+        poke_worker()
+
+# -----------------------
+# Baux : heartbeat, libération, reprise des jobs abandonnés
+# -----------------------
+def _release_lease(job_id: int):
+    try:
+        with engine.begin() as conn:
+            conn.execute(
+                update(Job)
+                  .where(Job.id == job_id, Job.lease_owner == WORKER_ID)
+                  .values(lease_owner=None, lease_expires_at=None)
+            )
+    except Exception:
+        pass  # le bail expirera de lui-même
+
+def _renew_leases():
+    """
+    Prolonge les baux des jobs en cours ; ceux qui ne nous appartiennent
+    plus (repris après expiration) sont marqués perdus.
+    """
+    with _inflight_lock:
+        ids = list(_inflight)
+    if not ids:
+        return
+    with engine.begin() as conn:
+        conn.execute(
+            update(Job)
+              .where(Job.id.in_(ids), Job.lease_owner == WORKER_ID)
+              .values(lease_expires_at=_lease_until())
+        )
+        held = set(conn.execute(select(Job.id).where(Job.id.in_(ids), Job.lease_owner == WORKER_ID)).scalars())
+    with _inflight_lock:
+        _lost_leases.update(j for j in ids if j not in held and j in _inflight)
+
+def _heartbeat_loop():
+    while True:
+        time.sleep(HEARTBEAT_INTERVAL)
+        try:
+            _renew_leases()
+        except Exception:
+            pass  # base indisponible : on retente au prochain battement
+
+def reap_expired_leases(db: Session) -> list[int]:
+    """
+    Remet en READY les jobs actifs dont le bail a expiré (worker arrêté ou
+    planté) ou qui n'en ont pas (traités avant l'introduction des baux).
+    """
+    now = datetime.now(timezone.utc)
+    stale = or_(Job.lease_expires_at < now, Job.lease_expires_at.is_(None))
+    ids = [
+        job_id for (job_id,) in
+        db.query(Job.id).filter(Job.status.in_(ACTIVE_STATUSES), stale).limit(100).all()
+    ]
+    reaped = []
+    for job_id in ids:
+        res = db.execute(
+            update(Job)
+              .where(Job.id == job_id, Job.status.in_(ACTIVE_STATUSES), stale)
+              .values(status="READY", lease_owner=None, lease_expires_at=None,
+                      progress_msg="Reprise après l’arrêt d’un worker…")
+        )
+        db.commit()
+        if res.rowcount == 1:
+            reaped.append(job_id)
+            publish(job_event(db.get(Job, job_id)))
+    return reaped
+
+def _reaper_loop():
+    while True:
+        try:
+            with SessionLocal() as db:
+                if reap_expired_leases(db):
+                    poke_worker()
+        except Exception:
+            pass
+        time.sleep(REAPER_INTERVAL)
+
+def _requeue_inflight():
+    # Arrêt propre : nos jobs repartent tout de suite en file (sans attendre l'expiration)
+    with _inflight_lock:
+        ids = list(_inflight)
+        _lost_leases.update(ids)  # les étages encore en cours n'écriront plus
+    if not ids:
+        return
+    with engine.begin() as conn:
+        conn.execute(
+            update(Job)
+              .where(Job.id.in_(ids), Job.lease_owner == WORKER_ID, Job.status.in_(ACTIVE_STATUSES))
+              .values(status="READY", lease_owner=None, lease_expires_at=None,
+                      progress_msg="Worker arrêté : job remis en file.")
+        )
+    if IS_POSTGRES:
+        pg_notify(NOTIFY_CHANNEL)
+
+def _tts_loop():
+    # 1er étage : réserve les jobs READY en base, puis alimente la file de rendu
     while True:
+        seen_gen = _wake_gen
         with SessionLocal() as db:
-            job = (
-                db.query(Job)
-                  .filter(Job.status == "READY")
-                  .order_by(Job.created_at.asc())
-                  .first()
-            )
+            job = _claim_next_job(db)
             if not job:
-                time.sleep(1.0)
+                _wait_for_work(seen_gen)
                 continue
-            _process_job(db, job)
+            job_id = job.id
+            _enter_pipeline(job_id, job.user_id)
+            # relance / reprise : on saute les étages dont l'artefact est valide
+            start = resume_stage(job)
+            ok = _run_stage(_stage_tts if start == "tts" else _stage_checkpoint, db, job)
+        if ok:
+            # bloque si l'étage suivant est saturé
+            (_upload_queue if start == "upload" else _render_queue).put(job_id)
+        else:
+            _leave_pipeline(job_id)
+
+def _claim_due_deferred(db: Session):
+    """
+    Renvoie (ids des jobs DEFERRED arrivés à échéance, réservés pour l'upload,
+    prochaine échéance ou None).
+    """
+    now = datetime.now(timezone.utc)
+    due = [
+        job_id for (job_id,) in
+        db.query(Job.id).filter(Job.status == "DEFERRED", Job.retry_at <= now).order_by(Job.retry_at.asc()).all()
+    ]
+    claimed = []
+    for job_id in due:
+        res = db.execute(
+            update(Job)
+              .where(Job.id == job_id, Job.status == "DEFERRED")
+              .values(status="DONE", retry_at=None, progress_msg="Quota YouTube disponible. Reprise de l’upload…",
+                      lease_owner=WORKER_ID, lease_expires_at=_lease_until())
+        )
+        db.commit()
+        if res.rowcount == 1:
+            claimed.append(job_id)
+    nxt = db.query(func.min(Job.retry_at)).filter(Job.status == "DEFERRED").scalar()
+    db.rollback()
+    return claimed, _as_utc(nxt)
+
+def _deferred_loop():
+    # Relance l'upload des jobs reportés (quota) quand leur quota est remis à zéro
+    while True:
+        seen_gen = _wake_gen
+        with SessionLocal() as db:
+            claimed, nxt = _claim_due_deferred(db)
+            for job_id in claimed:
+                job = db.get(Job, job_id)
+                _enter_pipeline(job_id, job.user_id)
+                publish(job_event(job))
+        for job_id in claimed:
+            _upload_queue.put(job_id)
+        timeout = WORKER_IDLE_POLL
+        if nxt is not None:
+            timeout = min(timeout, max(0.0, (nxt - datetime.now(timezone.utc)).total_seconds()))
+        with _wake_cond:
+            _wake_cond.wait_for(lambda: _wake_gen != seen_gen, timeout=timeout)
+
+def _storage_loop():
+    # Rétention par statut, miniatures orphelines, puis budget disque
+    while True:
+        try:
+            with SessionLocal() as db:
+                storage.apply_retention(db)
+                storage.sweep_orphans(db)
+            storage.enforce_budget()
+            storage.usage(fresh=True)  # publié pour /health et /metrics (storage.last_usage)
+        except Exception:
+            pass  # réessayé au prochain balayage
+        time.sleep(STORAGE_SWEEP_INTERVAL)
+
+def _stage_loop(stage, inbox: queue.Queue, outbox: "queue.Queue | None"):
+    while True:
+        job_id = inbox.get()
+        with SessionLocal() as db:
+            job = db.get(Job, job_id)
+            ok = job is not None and _run_stage(stage, db, job)
+        if ok and outbox is not None:
+            outbox.put(job_id)
+        else:
+            _leave_pipeline(job_id)  # échec, dernier étage ou report
 
 def ensure_worker_running():
     global _worker_started
     if _worker_started:
         return
-    t = threading.Thread(target=_loop, daemon=True)
-    t.start()
+    pools = [
+        ("tts", TTS_CONCURRENCY, _tts_loop, ()),
+        ("render", RENDER_CONCURRENCY, _stage_loop, (_stage_render, _render_queue, _upload_queue)),
+        ("upload", UPLOAD_CONCURRENCY, _stage_loop, (_stage_upload, _upload_queue, None)),
+        ("deferred", 1, _deferred_loop, ()),
+        ("storage", 1, _storage_loop, ()),
+        ("heartbeat", 1, _heartbeat_loop, ()),
+        ("reaper", 1, _reaper_loop, ()),
+    ]
+    if IS_POSTGRES:
+        pools.append(("listen", 1, _pg_listen_loop, ()))
+    for name, count, target, args in pools:
+        for i in range(count):
+            t = threading.Thread(target=target, args=args, name=f"autopub-{name}-{i}", daemon=True)
+            t.start()
     _worker_started = True
 
+def collect_metrics():
+    # jauges lues au moment du scrape (pas de requête en base)
+    STAGE_QUEUE_DEPTH.set(_render_queue.qsize(), stage="render")
+    STAGE_QUEUE_DEPTH.set(_upload_queue.qsize(), stage="upload")
+    STORAGE_BYTES.replace({(cat,): n for cat, n in storage.last_usage().items() if cat != "total"})
+
 def poke_worker():
-    return
+    """
+    Signale qu'un ou plusieurs jobs READY viennent d'être créés.
+    """
+    _wake_local()
+    if IS_POSTGRES:
+        pg_notify(NOTIFY_CHANNEL)
+
+# -----------------------
+# Worker autonome : python worker.py (API lancée avec RUN_WORKER_IN_API=0)
+# -----------------------
+def _serve_metrics(port: int):
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    # local par défaut ; WORKER_METRICS_HOST=0.0.0.0 pour un scrape distant (avec METRICS_TOKEN)
+    host = os.getenv("WORKER_METRICS_HOST") or "127.0.0.1"
+    token = os.getenv("METRICS_TOKEN", "")
+
+    class _Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            # même contrôle que /metrics de l'API
+            if token and self.headers.get("Authorization") != f"Bearer {token}":
+                self.send_error(401)
+                return
+            collect_metrics()
+            body = metrics.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer((host, port), _Handler)
+    threading.Thread(target=server.serve_forever, name="autopub-metrics", daemon=True).start()
+
+def main():
+    ensure_schema()
+    ensure_worker_running()
+    port = int(os.getenv("WORKER_METRICS_PORT", "0"))
+    if port:
+        _serve_metrics(port)
+    stop = threading.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(sig, lambda *_: stop.set())
+    print(f"worker {WORKER_ID} démarré (bail {LEASE_SECONDS:.0f} s)", flush=True)
+    # attente par tranches : sous Windows, un wait() sans délai ignore Ctrl+C
+    while not stop.wait(1):
+        pass
+    _requeue_inflight()
+    print(f"worker {WORKER_ID} arrêté", flush=True)
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,21 @@
 # youtube_uploader.py — par utilisateur + compat Render
-import os
+import os, time, uuid, json, random, threading
 from pathlib import Path
-from datetime import datetime, timezone
-from typing import Optional, List, Union
+from datetime import datetime, timezone, timedelta
+from typing import Optional, List, Union, Callable
 
+import httplib2
+import pytz
+import requests
+from google_auth_httplib2 import AuthorizedHttp
 from googleapiclient.discovery import build
 from googleapiclient.http import MediaFileUpload
 from googleapiclient.errors import HttpError
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
+from google.auth.transport.requests import Request, AuthorizedSession
+
+import metrics
 
 SCOPES = ["https://www.googleapis.com/auth/youtube.upload"]
 
@@ -18,11 +24,202 @@ DATA_DIR = Path(os.getenv("APP_DATA_DIR", ".")).resolve()
 TOKENS_DIR = (DATA_DIR / "tokens").resolve()
 TOKENS_DIR.mkdir(parents=True, exist_ok=True)
 
+# Client YouTube mis en cache par utilisateur (build() est coûteux)
+YOUTUBE_CLIENT_TTL = float(os.getenv("YOUTUBE_CLIENT_TTL", "3600"))
+# On ne rafraîchit le token qu'à l'approche de son expiration
+TOKEN_REFRESH_MARGIN = timedelta(minutes=5)
+
+# Upload résumable par morceaux (multiple de 256 Ko imposé par l'API)
+YOUTUBE_UPLOAD_URL = os.getenv("YOUTUBE_UPLOAD_URL") or "https://www.googleapis.com/upload/youtube/v3/videos"
+UPLOAD_CHUNK_SIZE = max(1, int(os.getenv("YOUTUBE_CHUNK_MB", "8"))) * 1024 * 1024
+
+# Quota YouTube Data API : coût en unités par appel, budget quotidien par
+# utilisateur (chaque compte a son propre projet Google), remis à zéro à minuit
+# heure du Pacifique.
+QUOTA_COSTS = {"videos.insert": 1600, "thumbnails.set": 50}
+# Coût projeté d'un upload complet (les jobs ont toujours une miniature) :
+# même valeur pour l'ordonnanceur (quota_exhausted_users) et la réservation
+UPLOAD_QUOTA_CALLS = ("videos.insert", "thumbnails.set")
+YOUTUBE_DAILY_QUOTA = int(os.getenv("YOUTUBE_DAILY_QUOTA", "10000"))
+QUOTA_TZ = pytz.timezone("America/Los_Angeles")
+_QUOTA_REASONS = {"quotaExceeded", "dailyLimitExceeded", "uploadLimitExceeded"}
+
+# Erreurs transitoires : backoff exponentiel avec jitter
+YOUTUBE_MAX_RETRIES = max(0, int(os.getenv("YOUTUBE_MAX_RETRIES", "5")))
+YOUTUBE_BACKOFF_BASE = float(os.getenv("YOUTUBE_BACKOFF_BASE", "1"))
+YOUTUBE_BACKOFF_MAX = float(os.getenv("YOUTUBE_BACKOFF_MAX", "64"))
+_RETRY_STATUSES = {429, 500, 502, 503, 504}
+_RATE_REASONS = {"rateLimitExceeded", "userRateLimitExceeded"}
+
+UPLOAD_SECONDS = metrics.Histogram("autopub_upload_to_youtube_seconds", "Durée de upload_to_youtube() réussi")
+UPLOADED_BYTES = metrics.Counter("autopub_uploaded_bytes_total", "Octets de vidéo acquittés par YouTube")
+YOUTUBE_RETRIES = metrics.Counter("autopub_youtube_retries_total", "Nouvelles tentatives après erreur transitoire")
+QUOTA_DEFERRALS = metrics.Counter("autopub_youtube_quota_exceeded_total", "Appels bloqués faute de quota")
+
+_clients: dict[int, tuple[float, tuple, Credentials, object]] = {}
+_clients_lock = threading.Lock()
+_user_locks: dict[int, threading.Lock] = {}
+
+class QuotaExceeded(Exception):
+    """
+    Quota du jour épuisé pour cet utilisateur : réessayer à retry_at (UTC).
+    """
+    def __init__(self, retry_at: datetime):
+        super().__init__(f"Quota YouTube atteint, reprise le {retry_at:%Y-%m-%d %H:%M} UTC")
+        self.retry_at = retry_at
+
+def next_quota_reset(now: Optional[datetime] = None) -> datetime:
+    now = (now or datetime.now(timezone.utc)).astimezone(QUOTA_TZ)
+    midnight = QUOTA_TZ.localize(datetime(now.year, now.month, now.day) + timedelta(days=1))
+    # petite marge : la remise à zéro côté Google n'est pas instantanée
+    return midnight.astimezone(timezone.utc) + timedelta(minutes=5)
+
+class _QuotaBucket:
+    """
+    Seau de jetons par utilisateur : YOUTUBE_DAILY_QUOTA unités, rempli
+    à chaque remise à zéro du quota YouTube.
+    """
+    def __init__(self):
+        self.tokens = YOUTUBE_DAILY_QUOTA
+        self.reset_at = next_quota_reset()
+
+    def _refill(self):
+        if datetime.now(timezone.utc) >= self.reset_at:
+            self.tokens = YOUTUBE_DAILY_QUOTA
+            self.reset_at = next_quota_reset()
+
+    def take(self, cost: int):
+        self._refill()
+        if self.tokens < cost:
+            QUOTA_DEFERRALS.inc()
+            raise QuotaExceeded(self.reset_at)
+        self.tokens -= cost
+
+    def refund(self, cost: int):
+        self._refill()
+        self.tokens = min(YOUTUBE_DAILY_QUOTA, self.tokens + cost)
+
+    def exhaust(self):
+        # YouTube a refusé (403 quota) : notre estimation était trop optimiste
+        self._refill()
+        self.tokens = 0
+
+_buckets: dict[int, _QuotaBucket] = {}
+_buckets_lock = threading.Lock()
+
+def _bucket(user_id: int) -> _QuotaBucket:
+    return _buckets.setdefault(user_id, _QuotaBucket())
+
+def take_quota(user_id: int, *calls: str):
+    """
+    Réserve le quota de plusieurs appels d'un coup, ou lève QuotaExceeded.
+    """
+    with _buckets_lock:
+        _bucket(user_id).take(sum(QUOTA_COSTS[c] for c in calls))
+
+def refund_quota(user_id: int, *calls: str):
+    """
+    Rend le quota d'appels réservés mais jamais envoyés à l'API.
+    """
+    with _buckets_lock:
+        _bucket(user_id).refund(sum(QUOTA_COSTS[c] for c in calls))
+
+def quota_exhausted_users() -> set[int]:
+    """
+    Utilisateurs sans quota pour un nouvel upload (inutile de rendre leurs vidéos).
+    """
+    now = datetime.now(timezone.utc)
+    cost = sum(QUOTA_COSTS[c] for c in UPLOAD_QUOTA_CALLS)
+    with _buckets_lock:
+        return {
+            uid for uid, b in _buckets.items()
+            if now < b.reset_at and b.tokens < cost
+        }
+
+def _error_reason(e: HttpError) -> str:
+    try:
+        return json.loads(e.content)["error"]["errors"][0]["reason"]
+    except (ValueError, KeyError, IndexError, TypeError):
+        return ""
+
+def _quota_error(user_id: int, e: Exception) -> Optional[QuotaExceeded]:
+    if isinstance(e, HttpError) and e.resp.status == 403 and _error_reason(e) in _QUOTA_REASONS:
+        with _buckets_lock:
+            b = _bucket(user_id)
+            b.exhaust()
+            return QuotaExceeded(b.reset_at)
+    return None
+
+def _is_transient(e: Exception) -> bool:
+    if isinstance(e, HttpError):
+        return e.resp.status in _RETRY_STATUSES or (e.resp.status == 403 and _error_reason(e) in _RATE_REASONS)
+    return isinstance(e, (requests.ConnectionError, requests.Timeout, httplib2.HttpLib2Error, ConnectionError, TimeoutError))
+
+def _backoff(attempt: int) -> float:
+    # "full jitter" : les workers ne se resynchronisent pas sur les mêmes instants
+    return random.uniform(0, min(YOUTUBE_BACKOFF_MAX, YOUTUBE_BACKOFF_BASE * 2 ** attempt))
+
+def _with_retries(user_id: int, call: Callable):
+    """
+    Exécute call(), avec backoff sur les erreurs transitoires ;
+    un refus de quota devient QuotaExceeded.
+    """
+    attempt = 0
+    while True:
+        try:
+            return call()
+        except Exception as e:
+            quota = _quota_error(user_id, e)
+            if quota is not None:
+                QUOTA_DEFERRALS.inc()
+                raise quota from e
+            if attempt >= YOUTUBE_MAX_RETRIES or not _is_transient(e):
+                raise
+            YOUTUBE_RETRIES.inc()
+            time.sleep(_backoff(attempt))
+            attempt += 1
+
 def _user_tokens_dir(user_id: int) -> Path:
     p = TOKENS_DIR / str(user_id)
     p.mkdir(parents=True, exist_ok=True)
     return p
 
+def _write_token(token_path: Path, creds: Credentials):
+    # écriture atomique : un crash ne laisse jamais un token tronqué
+    tmp = token_path.with_name(f".{token_path.name}.{uuid.uuid4().hex[:8]}.tmp")
+    with open(tmp, "w") as f:
+        f.write(creds.to_json())
+    os.replace(tmp, token_path)
+
+def _needs_refresh(creds: Credentials) -> bool:
+    if not creds.token:
+        return True
+    # expiry est en UTC naïf côté google-auth
+    return creds.expiry is not None and creds.expiry - TOKEN_REFRESH_MARGIN <= datetime.utcnow()
+
+def _refresh_if_needed(user_id: int, creds: Credentials):
+    if _needs_refresh(creds) and creds.refresh_token:
+        creds.refresh(Request())
+        token_path = _user_tokens_dir(user_id) / "youtube_token.json"
+        # token supprimé entre-temps (nouveau client_secret.json) : on ne le
+        # recrée pas, sinon le nouveau consentement n'aurait jamais lieu
+        if token_path.exists():
+            _write_token(token_path, creds)
+
+def _credentials_stamp(user_id: int) -> tuple:
+    """
+    mtimes de client_secret.json et youtube_token.json : un changement fait
+    par un autre process (API, autre worker) invalide le client en cache.
+    """
+    tdir = _user_tokens_dir(user_id)
+    stamp = []
+    for name in ("client_secret.json", "youtube_token.json"):
+        try:
+            stamp.append((tdir / name).stat().st_mtime_ns)
+        except FileNotFoundError:
+            stamp.append(None)
+    return tuple(stamp)
+
 def _credentials_for_user(user_id: int) -> Credentials:
     tdir = _user_tokens_dir(user_id)
     client_secret = tdir / "client_secret.json"
@@ -35,24 +232,133 @@ def _credentials_for_user(user_id: int) -> Credentials:
     if token_path.exists():
         creds = Credentials.from_authorized_user_file(str(token_path), SCOPES)
 
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-        else:
-            flow = InstalledAppFlow.from_client_secrets_file(str(client_secret), SCOPES)
-            creds = flow.run_local_server(port=0)
-        with open(token_path, "w") as f:
-            f.write(creds.to_json())
+    if creds and creds.refresh_token:
+        _refresh_if_needed(user_id, creds)
+    elif not creds or not creds.valid:
+        flow = InstalledAppFlow.from_client_secrets_file(str(client_secret), SCOPES)
+        creds = flow.run_local_server(port=0)
+        _write_token(token_path, creds)
 
     return creds
 
+def _user_lock(user_id: int) -> threading.Lock:
+    with _clients_lock:
+        return _user_locks.setdefault(user_id, threading.Lock())
+
+def _client_for_user(user_id: int):
+    """
+    Renvoie (youtube, creds) depuis le cache ; reconstruit après TTL,
+    invalidation ou modification des fichiers d'identifiants, rafraîchit
+    le token seulement près de l'expiration.
+    """
+    with _user_lock(user_id):
+        cached = _clients.get(user_id)
+        stamp = _credentials_stamp(user_id)
+        if cached and cached[1] == stamp and time.monotonic() - cached[0] < YOUTUBE_CLIENT_TTL:
+            built_at, _, creds, youtube = cached
+            _refresh_if_needed(user_id, creds)
+            # notre propre réécriture du token ne doit pas invalider l'entrée
+            _clients[user_id] = (built_at, _credentials_stamp(user_id), creds, youtube)
+            return youtube, creds
+        creds = _credentials_for_user(user_id)
+        # document de découverte embarqué dans googleapiclient : pas d'appel réseau
+        youtube = build("youtube", "v3", credentials=creds, static_discovery=True, cache_discovery=False)
+        _clients[user_id] = (time.monotonic(), _credentials_stamp(user_id), creds, youtube)
+        return youtube, creds
+
+def invalidate_youtube_client(user_id: int):
+    """
+    À appeler quand les identifiants de l'utilisateur changent (les autres
+    process le détectent via les mtimes des fichiers, voir _credentials_stamp).
+    """
+    with _user_lock(user_id):
+        _clients.pop(user_id, None)
+
+def _authorized_http(creds: Credentials) -> AuthorizedHttp:
+    # le service est partagé entre threads, mais httplib2 ne l'est pas :
+    # chaque appel utilise son propre transport
+    return AuthorizedHttp(creds, http=httplib2.Http())
+
 def get_youtube_for_user(user_id: int):
-    creds = _credentials_for_user(user_id)
-    return build("youtube", "v3", credentials=creds)
+    youtube, _ = _client_for_user(user_id)
+    return youtube
 
-def set_thumbnail(youtube, video_id: str, thumb_path: str):
+def set_thumbnail(youtube, video_id: str, thumb_path: str, http=None):
     media = MediaFileUpload(thumb_path)
-    youtube.thumbnails().set(videoId=video_id, media_body=media).execute()
+    youtube.thumbnails().set(videoId=video_id, media_body=media).execute(http=http)
+
+# -----------------------
+# Upload résumable (protocole YouTube "uploadType=resumable")
+# -----------------------
+class UploadSessionExpired(Exception):
+    pass
+
+def _http_error(resp) -> HttpError:
+    return HttpError(httplib2.Response({"status": resp.status_code}), resp.content, uri=resp.url)
+
+def _acked_offset(resp) -> int:
+    # 308 Resume Incomplete : "Range: bytes=0-<dernier octet reçu>"
+    rng = resp.headers.get("Range")
+    return int(rng.rsplit("-", 1)[1]) + 1 if rng else 0
+
+def _start_session(session: AuthorizedSession, body: dict, size: int) -> str:
+    r = session.post(
+        YOUTUBE_UPLOAD_URL,
+        params={"uploadType": "resumable", "part": "snippet,status"},
+        json=body,
+        headers={"X-Upload-Content-Length": str(size), "X-Upload-Content-Type": "video/*"},
+    )
+    if r.status_code != 200 or "Location" not in r.headers:
+        raise _http_error(r)
+    return r.headers["Location"]
+
+def _query_session(session: AuthorizedSession, uri: str, size: int):
+    """
+    Demande au serveur où en est une session existante.
+    Renvoie (offset, réponse finale ou None).
+    """
+    r = session.put(uri, headers={"Content-Range": f"bytes */{size}", "Content-Length": "0"})
+    if r.status_code in (200, 201):
+        return size, r.json()
+    if r.status_code == 308:
+        return _acked_offset(r), None
+    if r.status_code in (404, 410):
+        raise UploadSessionExpired(uri)
+    raise _http_error(r)
+
+def _resumable_upload(
+    session: AuthorizedSession,
+    video_path: str,
+    body: dict,
+    resume_uri: Optional[str],
+    on_progress: Callable[[str, int, int], None],
+) -> dict:
+    size = os.path.getsize(video_path)
+    uri, offset = None, 0
+    if resume_uri:
+        try:
+            offset, done = _query_session(session, resume_uri, size)
+            uri = resume_uri
+            if done is not None:
+                return done
+        except UploadSessionExpired:
+            uri = None  # session expirée (~1 semaine) : on repart de zéro
+    if uri is None:
+        uri, offset = _start_session(session, body, size), 0
+    on_progress(uri, offset, size)
+
+    with open(video_path, "rb") as f:
+        while True:
+            f.seek(offset)
+            chunk = f.read(UPLOAD_CHUNK_SIZE)
+            r = session.put(uri, data=chunk, headers={"Content-Range": f"bytes {offset}-{offset + len(chunk) - 1}/{size}"})
+            if r.status_code in (200, 201):
+                on_progress(uri, size, size)
+                return r.json()
+            if r.status_code != 308:
+                raise _http_error(r)
+            offset = _acked_offset(r)
+            on_progress(uri, offset, size)
 
 def upload_to_youtube(
     user_id: int,
@@ -64,8 +370,17 @@ def upload_to_youtube(
     categoryId: str = "22",
     made_for_kids: bool = False,
     thumbnail_path: Optional[str] = None,
+    resume_uri: Optional[str] = None,
+    on_progress: Optional[Callable[[str, int, int], None]] = None,
 ) -> str:
-    youtube = get_youtube_for_user(user_id)
+    """
+    Envoie la vidéo par morceaux de YOUTUBE_CHUNK_MB. on_progress(uri, offset, total)
+    est appelé après chaque morceau acquitté : en conservant uri, un nouvel
+    appel avec resume_uri reprend au dernier octet reçu par YouTube.
+    """
+    t0 = time.perf_counter()
+    youtube, creds = _client_for_user(user_id)
+    http = _authorized_http(creds)
     if not title:
         title = "Sans titre"
 
@@ -91,22 +406,44 @@ def upload_to_youtube(
         body["status"]["privacyStatus"] = "private"
         body["status"]["publishAt"] = pt  # RFC3339 UTC
 
-    media = MediaFileUpload(video_path, mimetype="video/*", chunksize=-1, resumable=True)
-    request = youtube.videos().insert(part="snippet,status", body=body, media_body=media)
+    has_thumb = bool(thumbnail_path and os.path.exists(thumbnail_path))
+    # videos.insert est facturé à la création de la session : pas pour une reprise
+    calls = ([] if resume_uri else ["videos.insert"]) + (["thumbnails.set"] if has_thumb else [])
+    take_quota(user_id, *calls)
 
-    response = None
-    try:
-        while response is None:
-            status, response = request.next_chunk()
-        video_id = response.get("id")
-
-        if thumbnail_path and os.path.exists(thumbnail_path):
-            try:
-                set_thumbnail(youtube, video_id, thumbnail_path)
-            except Exception:
-                pass
+    # une erreur transitoire en plein envoi reprend la même session (pas de double facturation)
+    session_uri = resume_uri
+    acked = None
+    report = on_progress or (lambda *a: None)
 
-        return video_id
+    def track(uri: str, offset: int, total: int):
+        nonlocal session_uri, acked
+        if acked is not None and uri == session_uri and offset > acked:
+            UPLOADED_BYTES.inc(offset - acked)
+        session_uri, acked = uri, offset
+        report(uri, offset, total)
 
-    except HttpError:
+    try:
+        with AuthorizedSession(creds) as session:
+            response = _with_retries(user_id, lambda: _resumable_upload(session, video_path, body, session_uri, track))
+    except QuotaExceeded:
         raise
+    except Exception as e:
+        # quota rendu pour ce qui n'a pas atteint l'API : la miniature (jamais
+        # envoyée), et videos.insert si aucune session n'a été créée sans réponse
+        # HTTP (fichier illisible, réseau coupé). Une erreur HTTP peut être facturée.
+        unsent = ["thumbnails.set"] if has_thumb else []
+        if "videos.insert" in calls and session_uri is None and not isinstance(e, HttpError):
+            unsent.append("videos.insert")
+        refund_quota(user_id, *unsent)
+        raise
+    video_id = response.get("id")
+
+    if has_thumb:
+        try:
+            _with_retries(user_id, lambda: set_thumbnail(youtube, video_id, thumbnail_path, http=http))
+        except Exception:
+            pass
+
+    UPLOAD_SECONDS.observe(time.perf_counter() - t0)
+    return video_id